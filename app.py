@@ -6,20 +6,22 @@ from datetime import datetime
 from pathlib import Path
 import PyPDF2
 from main import (
-    create_context,
+    load_context,
     BgeSmallEmbedModel,
     T5LLM, OllamaLLM, GeminiLLM,
     network_participants,
     make_index,
-    perform_query,
-    scrape_save_data
+    scrape_save_data,
+    WarmQueryEngine
 )
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
+from src.async_query import AsyncQueryPipeline
+from src.response_cache import SemanticResponseCache
+from src.index_sync import sync_indices
+from src.rag_utils import make_ingestion_pipeline
 from syftbox.lib import Client, SyftPermission
-import shutil
 
-embed_model = BgeSmallEmbedModel()
+embed_model = BgeSmallEmbedModel(
+    cache_path=Path(os.path.expanduser("~")) / ".federated_rag" / "query_embedding_cache.json")
 # model_name = "qwen2.5:1.5b"
 # model_name = "qwen2.5:0.5b"
 # model_name = "qwen2.5:1.5b-instruct"
@@ -32,10 +34,13 @@ model_name = "deepseek-r1:1.5b"
 
 llm = OllamaLLM(model_name=model_name)  # T5LLM() #local setup
 client = Client.load()
-global_context = create_context()
-pipeline = IngestionPipeline(
-    transformations=[SentenceSplitter(
-        chunk_size=200, chunk_overlap=10), embed_model.embedding_model])
+global_context = load_context()
+pipeline = make_ingestion_pipeline(embed_model.embedding_model)
+
+# queries answered at once, further requests wait in the pipeline queue
+MAX_CONCURRENT_QUERIES = 4
+RETRIEVAL_WORKERS = 2
+MAX_QUEUED_REQUESTS = 64
 
 
 class SessionState:
@@ -52,7 +57,37 @@ class SessionState:
         self.query_count = 0
 
 
+# backend wide state (datasite paths, participants), chat state is per user via gr.State
 session = SessionState()
+# built lazily on first query, rebuilt only when an index folder changes
+response_cache = SemanticResponseCache(
+    persist_path=Path(os.path.expanduser("~")) / ".federated_rag" / "response_cache.json")
+
+
+def sync_local_indices():
+    # brings the indexes rebuilt by the index updater into the folder the engine watches
+    datasite_path = client.datasite_path.parent
+    participants = [participant for participant in network_participants(datasite_path)
+                    if any((datasite_path / participant / "public" / name).is_dir()
+                           for name in ("vector_index", "vector_index.old"))]
+    store_indices_locally(participants, datasite_path, session.datasite_path)
+
+
+query_engine = WarmQueryEngine(
+    source=session.datasite_path,
+    embed_model=embed_model,
+    llm=llm,
+    context=global_context,
+    response_cache=response_cache,
+    # changed participants are then hot reloaded on the next query
+    sync=sync_local_indices,
+    sync_interval=30.0
+)
+query_pipeline = AsyncQueryPipeline(
+    query_engine,
+    max_concurrency=MAX_CONCURRENT_QUERIES,
+    retrieval_workers=RETRIEVAL_WORKERS
+)
 
 
 def store_indices_locally(participants, datasite_path, target):
@@ -62,10 +97,8 @@ def store_indices_locally(participants, datasite_path, target):
             user_folder / "public" / "vector_index"
         index_path_dict[user_folder] = index_path
 
-    for user, index_path in index_path_dict.items():
-        path = target / f"vector_index_{user}"
-        shutil.copytree(index_path, path, dirs_exist_ok=True)
-        print(f"Index copied for {user} at {path}")
+    # only changed files are copied (or linked), departed participants are removed
+    return sync_indices(index_path_dict, target)
 
 
 def initialize_backend():
@@ -97,34 +130,29 @@ def initialize_backend():
         print("Error occurred during initialization:", str(e))
 
 
-def process_message(message, history, model_choice, gemini_key=None, file=None):
+async def process_message(message, history, model_choice, gemini_key=None,
+                          state=None, file=None):
+    # async generator handler : gradio re-renders the chat on every yield while the answer streams in
+    state = state or SessionState()
     try:
         if model_choice == "Gemini" and not gemini_key:
             gr.Warning("Please enter your Gemini API key")
-            return "", history, session.session_name
+            yield "", history, state.session_name, state
+            return
         if model_choice == "HuggingFace":
-            try:
-                response_obj = perform_query(
-                    query=message,
-                    source=session.datasite_path,  # ~/ ".federated_rag" / "data"
-                    embed_model=embed_model,
-                    llm=llm,
-                    context=global_context
-                )
-                response = response_obj
-            except Exception as e:
-                print(f"Error processing query: {str(e)}")
+            query_llm = llm
         else:
-            response = f"Processing with Gemini: {message}"
-            gemini_llm = GeminiLLM(api_key_path=gemini_key)
-            response_obj = perform_query(
-                query=message,
-                source=session.datasite_path,  # ~/ ".federated_rag" / "data"
-                embed_model=embed_model,
-                llm=gemini_llm,
-                context=global_context
-            )
-            response = response_obj
+            query_llm = GeminiLLM(api_key_path=gemini_key)
+
+        history.append((message, ""))
+        response = ""
+        try:
+            async for chunk in query_pipeline.stream(message, llm=query_llm, top_k=3):
+                response += chunk
+                history[-1] = (message, response)
+                yield "", history, state.session_name, state
+        except Exception as e:
+            print(f"Error processing query: {str(e)}")
         if file:
             try:
                 pdf_reader = PyPDF2.PdfReader(file.name)
@@ -135,26 +163,38 @@ def process_message(message, history, model_choice, gemini_key=None, file=None):
             except Exception as e:
                 response += f"\n\nError processing PDF: {str(e)}"
 
-        history.append((message, response))
+        history[-1] = (message, response)
+        state.chat_history = history
 
-        session.query_count += 1
-        if session.query_count <= 2:
-            session.session_name = update_session_name(message)
+        state.query_count += 1
+        if state.query_count <= 2:
+            state.session_name = update_session_name(message)
 
-        return "", history, session.session_name
+        yield "", history, state.session_name, state
     except Exception as e:
-        return "", history, session.session_name
+        yield "", history, state.session_name, state
 
 
 def get_metrics():
     cpu_percent = psutil.cpu_percent()
     memory_percent = psutil.virtual_memory().percent
-    return f"CPU: {cpu_percent:.1f}% | Memory: {memory_percent:.1f}%"
+    cache_stats = embed_model.cache_stats()
+    response_stats = response_cache.stats()
+    metrics = (f"CPU: {cpu_percent:.1f}% | Memory: {memory_percent:.1f}% | "
+               f"Query cache: {cache_stats.get('hits', 0)} hits / "
+               f"{cache_stats.get('misses', 0)} misses | "
+               f"Response cache: {response_stats['hits']} hits / "
+               f"{response_stats['misses']} misses")
+    if query_engine.engine is not None:
+        ciphertext_stats = query_engine.engine.ciphertext_cache.stats()
+        metrics += (f" | Ciphertexts loaded: {ciphertext_stats['size']} "
+                    f"({ciphertext_stats['bytes'] / 2**20:.0f} MB)")
+    return metrics
 
 
-def handle_model_selection(model_choice):
-    session.current_model = model_choice
-    return gr.update(visible=model_choice == "Gemini")
+def handle_model_selection(model_choice, state):
+    state.current_model = model_choice
+    return gr.update(visible=model_choice == "Gemini"), state
 
 
 def update_session_name(query):
@@ -182,6 +222,8 @@ def save_snapshot(history, session_name):
 def create_ui():
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
         gr.Markdown("<center><h1>🔮 Federated RAG </h1></center>")
+        # one SessionState per browser session, concurrent users no longer share chat state
+        user_state = gr.State(SessionState)
         with gr.Tab("FED-RAG-BOT"):
             with gr.Row():
                 with gr.Column(scale=1):
@@ -189,7 +231,7 @@ def create_ui():
 
                     session_name_display = gr.Textbox(
                         label="Session Name",
-                        value=session.session_name,
+                        value="Untitled Session",
                         interactive=False
                     )
 
@@ -242,22 +284,22 @@ def create_ui():
 
             model_dropdown.change(
                 fn=handle_model_selection,
-                inputs=model_dropdown,
-                outputs=gemini_key_input
+                inputs=[model_dropdown, user_state],
+                outputs=[gemini_key_input, user_state]
             )
 
             send.click(
                 fn=process_message,
                 inputs=[msg, chatbot, model_dropdown,
-                        gemini_key_input],
-                outputs=[msg, chatbot, session_name_display]
+                        gemini_key_input, user_state],
+                outputs=[msg, chatbot, session_name_display, user_state]
             )
 
             msg.submit(
                 fn=process_message,
                 inputs=[msg, chatbot, model_dropdown,
-                        gemini_key_input],
-                outputs=[msg, chatbot, session_name_display]
+                        gemini_key_input, user_state],
+                outputs=[msg, chatbot, session_name_display, user_state]
             )
 
             refresh_btn.click(
@@ -271,14 +313,15 @@ def create_ui():
             )
 
             clear_btn.click(
-                fn=lambda: clear_session_history(session_history),
-                outputs=session_history
+                fn=clear_session_history,
+                inputs=user_state,
+                outputs=[session_history, user_state]
             )
 
             delete_btn.click(
-                fn=lambda: delete_session(
-                    session_name_display, session_history),
-                outputs=[session_name_display, session_history]
+                fn=delete_session,
+                inputs=user_state,
+                outputs=[session_name_display, session_history, user_state]
             )
 
             demo.load(get_metrics, outputs=metrics_text, every=10)
@@ -320,21 +363,23 @@ def create_ui():
     return demo
 
 
-def clear_session_history(session_history):
-    session.chat_history = []
-    return gr.update(value="")
+def clear_session_history(state):
+    state.chat_history = []
+    return gr.update(value=""), state
 
 
-def delete_session(session_name_display, session_history):
-    session.chat_history = []
-    session.session_name = "Untitled Session"
-    session_name_display.update(value=session.session_name)
-    return gr.update(value=""), session_name_display
+def delete_session(state):
+    state.chat_history = []
+    state.session_name = "Untitled Session"
+    state.query_count = 0
+    return state.session_name, gr.update(value=""), state
 
 
 def main():
     initialize_backend()
     demo = create_ui()
+    # the async pipeline enforces MAX_CONCURRENT_QUERIES, gradio only bounds the queue size
+    demo.queue(default_concurrency_limit=None, max_size=MAX_QUEUED_REQUESTS)
     demo.launch(server_port=7861, show_error=True)
 
 
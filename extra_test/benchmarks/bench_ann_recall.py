@@ -0,0 +1,86 @@
+"""
+Recall vs latency of the IVF-flat ANN index against exact search.
+
+    python extra_test/benchmarks/bench_ann_recall.py
+    python extra_test/benchmarks/bench_ann_recall.py --chunks 20000 100000 --n-probe 1 4 8 16
+    python extra_test/benchmarks/bench_ann_recall.py --topics 1000 --spread 1.5
+
+Embeddings are synthetic normalized (chunks x 384) vectors drawn around --topics
+random topic directions with --spread noise. Tight topics (e.g. 200 topics,
+spread 0.6) put every neighbour in the query's own list and give recall 1.0 at
+any n_probe, the defaults are broad overlapping topics so neighbours fall in
+several lists and recall grows with n_probe. Queries are fresh draws from the
+same distribution, not perturbed chunks.
+recall@k is the share of the exact top-k found by the ANN search, speedup is
+exact ms / ivf ms per query.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.custom_utils.ann_index import ExactSearch, IVFFlatIndex
+
+
+def normalize(matrix):
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def synthetic_embeddings(n_rows, topics, spread, rng):
+    dim = topics.shape[1]
+    rows = topics[rng.integers(0, len(topics), n_rows)] + \
+        spread * rng.standard_normal((n_rows, dim)) / np.sqrt(dim)
+    return normalize(rows).astype(np.float32)
+
+
+def top_k(index, query, k):
+    candidates, scores = index.search(query, k)
+    return set(candidates[np.argpartition(scores, -k)[-k:]].tolist())
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    results = [top_k(index, query, k) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, nargs="+", default=[5000, 20000, 100000])
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--spread", type=float, default=3.0)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>7} | {'backend':>12} | {'build (s)':>9} | {'ms/query':>8} | "
+          f"{'speedup':>7} | {'recall@k':>8}")
+    for n_chunks in args.chunks:
+        topics = normalize(rng.standard_normal((args.topics, args.dim)))
+        matrix = synthetic_embeddings(n_chunks, topics, args.spread, rng)
+        queries = synthetic_embeddings(args.queries, topics, args.spread, rng)
+
+        exact_results, exact_ms = timed_search(ExactSearch(matrix), queries, args.top_k)
+        print(f"{n_chunks:>7} | {'exact':>12} | {0:>9.2f} | {exact_ms:>8.3f} | "
+              f"{1:>7.1f} | {1:>8.3f}")
+
+        start = time.perf_counter()
+        ivf = IVFFlatIndex().build(matrix)
+        build_time = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            results, ms = timed_search(ivf, queries, args.top_k)
+            recall = np.mean([len(found & expected) / args.top_k
+                              for found, expected in zip(results, exact_results)])
+            print(f"{n_chunks:>7} | {f'ivf probe={n_probe}':>12} | {build_time:>9.2f} | "
+                  f"{ms:>8.3f} | {exact_ms / ms:>7.1f} | {recall:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-row vs packed CKKS similarity benchmark.
+
+    python extra_test/benchmarks/bench_packed_ckks.py
+    python extra_test/benchmarks/bench_packed_ckks.py --sizes 1000 10000 50000 --rowwise-sample 200
+
+The per-row path costs the same for every row, so above --rowwise-sample rows it is
+timed on a sample and extrapolated linearly (marked with *).
+The packed path costs the same for every block (up to packed_block_rows rows), the
+last line is the row count from which it beats rowwise (GraphComposer.packed_min_rows).
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import numpy as np
+import tenseal as ts
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.custom_utils.encryptors import (create_context,
+                                         encrypt_embeddings,
+                                         encrypted_dot_product,
+                                         packed_block_rows,
+                                         packed_dot_product)
+
+
+def random_embeddings(n_rows, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((n_rows, dim))
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def bench_rowwise(matrix, query, context, sample):
+    n_rows = min(sample, len(matrix))
+    encrypted_rows = [ts.ckks_vector(context, row) for row in matrix[:n_rows]]
+    start = time.time()
+    encrypted_query = encrypt_embeddings(query, context)
+    scores = encrypted_dot_product(encrypted_query, encrypted_rows).reshape(-1,)
+    elapsed = (time.time() - start) * len(matrix) / n_rows
+    error = np.abs(scores - matrix[:n_rows] @ query).max()
+    return elapsed, error, n_rows < len(matrix)
+
+
+def bench_packed(matrix, query, context):
+    start = time.time()
+    encrypted_query = encrypt_embeddings(query, context)
+    query_time = time.time() - start
+
+    start = time.time()
+    scores = packed_dot_product(encrypted_query, matrix, context)
+    score_time = time.time() - start
+    n_blocks = -(-len(matrix) // packed_block_rows(context, matrix.shape[1]))
+    error = np.abs(scores - matrix @ query).max()
+    return query_time, score_time, n_blocks, error
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[128, 1000, 10000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--rowwise-sample", type=int, default=200)
+    args = parser.parse_args()
+
+    context = create_context()
+    print(f"{'chunks':>8} | {'rowwise query (s)':>18} | {'packed query (s)':>16} | "
+          f"{'decrypts':>8} | {'speedup':>8} | max err")
+    crossover = None
+    for n_rows in args.sizes:
+        matrix = random_embeddings(n_rows, args.dim)
+        query = matrix[0]
+        rowwise_time, rowwise_error, extrapolated = bench_rowwise(
+            matrix, query, context, args.rowwise_sample)
+        query_time, score_time, n_blocks, packed_error = bench_packed(
+            matrix, query, context)
+        packed_time = query_time + score_time
+        crossover = int(np.ceil(packed_time / n_blocks / (rowwise_time / n_rows)))
+        print(f"{n_rows:>8} | {rowwise_time:>17.2f}{'*' if extrapolated else ' '} | "
+              f"{packed_time:>16.2f} | {n_blocks:>8} | "
+              f"{rowwise_time / packed_time:>7.1f}x | "
+              f"{max(rowwise_error, packed_error):.2e}")
+    print(f"packed beats rowwise from ~{crossover} chunks, "
+          f"peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
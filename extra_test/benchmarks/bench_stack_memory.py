@@ -0,0 +1,88 @@
+"""
+Peak memory of stacking participant embeddings, list based float64 (previous
+GraphComposer.stack_info) against the preallocated float32 / float16 matrix.
+
+    python extra_test/benchmarks/bench_stack_memory.py
+    python extra_test/benchmarks/bench_stack_memory.py --participants 500 --chunks 100
+
+Participants are stand-ins for CustomIndex holding random (chunks x 384) embeddings,
+only stack_info runs (no llama_index loading, no packing, exact search).
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.custom_utils.custom_compose import GraphComposer
+from src.custom_utils.ciphertext_cache import LazyCiphertextMatrix
+
+
+class StubIndex:
+    def __init__(self, name, n_chunks, dim, dtype, rng):
+        self.base_index_folder = name
+        self.unencrypted_embedding_matrix = rng.standard_normal((n_chunks, dim)).astype(dtype)
+        self.encrypted_embedding_matrix = LazyCiphertextMatrix([], [], [], None)
+        self.node_info = [None] * n_chunks
+        self.text_info = [""] * n_chunks
+        self.extra_info = [{}] * n_chunks
+        self.participant_info = [name] * n_chunks
+        self.snippet_info = [""] * n_chunks
+        self.enc_centroids = []
+        self.centroid_info = np.full(n_chunks, -1)
+
+
+def list_stack(indexes):
+    # previous implementation : python lists of rows, then np.array (float64)
+    matrix = []
+    for index in indexes:
+        matrix.extend(index.unencrypted_embedding_matrix.tolist())
+    return np.array(matrix)
+
+
+def preallocated_stack(indexes, dtype, matrix_path=None):
+    composer = object.__new__(GraphComposer)
+    composer.embedding_dtype = dtype
+    composer.matrix_path = matrix_path
+    composer.ciphertext_cache = None
+    composer.encrypted_mode = "rowwise"
+    composer.ann_backend = "exact"
+    composer.ann_min_rows, composer.ann_path, composer.ann_n_probe = 0, None, 1
+    composer.stack_info(indexes)
+    return composer.global_unencrypted_embedding_matrix
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    matrix = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>22} | {elapsed:>8.2f} | {peak / 2**20:>14.1f} | {matrix.nbytes / 2**20:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--matrix-path", default="/tmp/federated_rag_bench_matrix.npy")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    indexes = [StubIndex(f"vector_index_{i}", args.chunks, args.dim, np.float32, rng)
+               for i in range(args.participants)]
+    print(f"{'stacking':>22} | {'time (s)':>8} | {'peak traced MB':>14} | {'matrix MB':>11}")
+    measure("list + np.array f64", lambda: list_stack(indexes))
+    measure("preallocated f32", lambda: preallocated_stack(indexes, np.float32))
+    measure("preallocated f16", lambda: preallocated_stack(indexes, np.float16))
+    measure("memmap f32", lambda: preallocated_stack(indexes, np.float32, args.matrix_path))
+    os.remove(args.matrix_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Load test of the async query pipeline with N simulated users against a stub LLM.
+
+    python extra_test/benchmarks/load_test_async_query.py
+    python extra_test/benchmarks/load_test_async_query.py --users 1 2 4 8 16 --max-concurrency 8
+
+Retrieval is a real numpy scoring over a random (chunks x 384) matrix, the stub LLM
+streams --tokens tokens with --token-delay seconds between them (like a remote model).
+Throughput should grow with the number of users up to --max-concurrency.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.async_query import AsyncQueryPipeline
+
+
+class StubLLM:
+    def __init__(self, tokens, token_delay):
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    def stream_response(self, context, query):
+        for i in range(self.tokens):
+            time.sleep(self.token_delay)
+            yield f"token{i} "
+
+
+class StubComposer:
+    """ stands in for GraphComposer : plaintext scoring + the streaming hooks """
+
+    def __init__(self, n_chunks, llm, dim=384):
+        rng = np.random.default_rng(0)
+        self.matrix = rng.standard_normal((n_chunks, dim)).astype(np.float32)
+        self.llm = llm
+
+    def enc_retriever(self, query, top_k=3):
+        query_embedding = self.matrix[hash(query) % len(self.matrix)]
+        scores = self.matrix @ query_embedding
+        top_k_indices = np.argpartition(scores, -top_k)[-top_k:]
+        return {"collected_text_info": [f"chunk {i}" for i in top_k_indices]}
+
+    def cached_response(self, query, llm=None, top_k=3):
+        return None
+
+    def store_response(self, query, response, llm=None, top_k=3):
+        pass
+
+    def build_context(self, retrieved_out, sep="---------"):
+        return f"\n{sep}\n".join(retrieved_out["collected_text_info"])
+
+    def stream_answer(self, context, query, llm=None, start=None):
+        yield from (llm or self.llm).stream_response(context, query)
+
+
+class StubEngine:
+    def __init__(self, composer):
+        self.composer = composer
+
+    def get(self):
+        return self.composer
+
+
+async def simulated_user(pipeline, user_id, queries_per_user, latencies):
+    for i in range(queries_per_user):
+        start = time.time()
+        await pipeline.answer(f"user {user_id} question {i}")
+        latencies.append(time.time() - start)
+
+
+async def run(n_users, args):
+    composer = StubComposer(args.chunks, StubLLM(args.tokens, args.token_delay))
+    pipeline = AsyncQueryPipeline(StubEngine(composer),
+                                  max_concurrency=args.max_concurrency,
+                                  retrieval_workers=args.retrieval_workers)
+    latencies = []
+    start = time.time()
+    await asyncio.gather(*[simulated_user(pipeline, user_id, args.queries_per_user, latencies)
+                           for user_id in range(n_users)])
+    elapsed = time.time() - start
+    pipeline.shutdown()
+    return len(latencies) / elapsed, float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--queries-per-user", type=int, default=4)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--retrieval-workers", type=int, default=2)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(f"{'users':>6} | {'queries/s':>9} | {'mean latency (s)':>16} | {'p95 latency (s)':>15}")
+    for n_users in args.users:
+        throughput, mean_latency, p95_latency = asyncio.run(run(n_users, args))
+        print(f"{n_users:>6} | {throughput:>9.2f} | {mean_latency:>16.2f} | {p95_latency:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
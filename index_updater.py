@@ -1,25 +1,22 @@
-from collections import defaultdict
+import argparse
 from pathlib import Path
 from typing import List
 from syftbox.lib import Client, SyftPermission
 import json
 import os
+import time
 from datetime import datetime
 import re
 
-from src.custom_utils.encryptors import create_context
+from src.custom_utils.context_store import load_context
 from src.lm_utils.embedding_models.base_embeds import BgeSmallEmbedModel
 from src.lm_utils.llms.base_lm import T5LLM, GeminiLLM, OllamaLLM
-from src.rag_utils import index_creator, load_query_engine
-
-from src.data_utils.linkedin_extractor import LinkedinScraper
-from src.data_utils.resume_extractor import pdf_to_text
-from src.data_utils.github_extractor import get_github_user_info
-from src.utils import remove_emails_and_phone_numbers
-
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
+from src.rag_utils import load_query_engine, run_index_jobs, make_ingestion_pipeline
+from src.file_watcher import make_watcher, debounced_changes
+from src.manifest_utils import file_sha256
 
+from src.data_utils.scrape_pipeline import (scrape_participants,
+                                            LINKEDIN, GITHUB, RESUME)
 
 
 def should_run(output_file_path: str) -> bool:
@@ -50,20 +47,21 @@ def save_run(output_folder: str, output_file_path: str):
     print(f"Timestamp has been written to {output_file_path}")
 
 
-def make_index(participants: list[str], datasite_path: Path, context, pipeline):
+def make_index(participants: list[str], datasite_path: Path, context, pipeline,
+               workers=1, embed_batch_size=32):
     print("Computing indices..")
-    indexes = {}
-    active_participants = []
+    jobs = []
     for user_folder in participants:
         value_file: Path = Path(datasite_path) / \
             user_folder / "public" / "bio.txt"
         if value_file.exists():
-            index = index_creator(value_file, target_path=Path(
-                datasite_path) / user_folder / "public", context=context, node_pipeline=pipeline)
-            indexes[user_folder] = index
-            active_participants.append(user_folder)
+            jobs.append((user_folder, value_file,
+                         Path(datasite_path) / user_folder / "public"))
+    active_participants = run_index_jobs(jobs, context=context,
+                                         node_pipeline=pipeline, workers=workers,
+                                         embed_batch_size=embed_batch_size)
     print("Found {} indices and the active participants are: {}".format(
-        len(indexes), active_participants))
+        len(active_participants), active_participants))
     return active_participants
 
 
@@ -109,79 +107,80 @@ def get_links_from_config(config_path: Path):
     return links
 
 
-def scrape_save_data(participants: list[str], datasite_path: Path):
-    active_participants = []
-    inactive_participants = []
-    sources_found = defaultdict(list)
-    
-    for participant in participants:
-        participant_path = Path(datasite_path)/participant/"public"
-        participant_path.mkdir(parents=True, exist_ok=True)
-        bio_path = participant_path/"bio.txt"
-        if bio_path.exists():
-            print(
-                f"Skipping data extraction for {participant}: bio already exists")
-            continue
-        config_path = participant_path / "config.json"
-        links = get_links_from_config(config_path)
-        extracted_info = []
-
-        try:
-            if links['linkedin']:
-                try:
-                    linkedin_scraper = LinkedinScraper(user_email='', pwd='')
-                    profile_username = linkedin_scraper.get_profile_usr(
-                        links['linkedin'])
-                    profile_data = linkedin_scraper.scrape_profile(
-                        profile_username)
-
-                    extracted_info.append("# Linkedin Information:\n")
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(str(profile_data)))
-                    
-                    sources_found[participant].append('linkedin')
-                except Exception as e:
-                    print(f"LinkedIn scraping failed for {participant}: {e}")
-
-            if links['github']:
-                try:
-                    git_data = get_github_user_info(links['github'])
-
-                    extracted_info.append('# Github Information:\n')
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(git_data))
-                    sources_found[participant].append('github')
-                except Exception as e:
-                    print(f"Github scraping failed for {participant}: {e}")
-
-            if links['resume_path']:
-                print(f"RESUME PATH: {links['resume_path']}")
-                try:
-                    resume_data = pdf_to_text(links['resume_path'])
-
-                    extracted_info.append('# Resume: \n')
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(resume_data))
-                    sources_found[participant].append('resume')
-
-                except Exception as e:
-                    print(f"Resume parsing failed for {participant}: {e}")
-
-            if len(extracted_info) > 0:
-                with open(bio_path, 'w', encoding='utf-8') as bio_file:
-                    bio_file.writelines(extracted_info)
-                    active_participants.append(participant)
-                    # print(
-                    #     f"Successfully processed and saved bio for {participant}")
-            else:
-                inactive_participants.append(participant)
-
-        except Exception as e:
-            print(f"Overall data extraction failed for {participant}: {e}")
+def scrape_save_data(participants: list[str], datasite_path: Path, max_workers=8,
+                     force_participants=()):
+    # every source of every participant is scraped concurrently, see scrape_participants
+    active_participants, inactive_participants, sources_found = scrape_participants(
+        participants, datasite_path,
+        get_links=get_links_from_config,
+        sources=[LINKEDIN, GITHUB, RESUME],
+        max_workers=max_workers,
+        force_participants=force_participants)
 
     print(f"Contributing participants: {active_participants}")
     print(f"Non-contributing participants: {inactive_participants}")
-    print(f'Sources found for each participant: {sources_found}')
+    print(f'Sources found for each participant: {dict(sources_found)}')
+
+
+def update_participants(participants: list[str], datasite_path: Path, context, pipeline,
+                        workers=1, embed_batch_size=32, rescrape=()):
+    # rescrape : participants whose bio.txt is scraped again (config.json changed)
+    start = time.time()
+    scrape_save_data(participants, datasite_path, force_participants=rescrape)
+    active_participants = make_index(participants, datasite_path,
+                                     context=context, pipeline=pipeline,
+                                     workers=workers, embed_batch_size=embed_batch_size)
+    print(f"Updated {len(participants)} participants in {time.time() - start:.1f}s")
+    return active_participants
+
+
+def config_hash(datasite_path: Path, participant):
+    config_path = Path(datasite_path) / participant / "public" / "config.json"
+    try:
+        return file_sha256(config_path)
+    except OSError:
+        return None
+
+
+def run_daemon(datasite_path: Path, context, pipeline, workers=1, embed_batch_size=32,
+               debounce=2.0, poll_interval=2.0):
+    """
+    Long running mode : one full pass, then waits for bio.txt / config.json changes
+    (inotify, or stat polling) and reindexes only the participants whose files
+    changed, those whose config.json content changed get their bio.txt scraped
+    again first. Bursts of events are merged with a `debounce` second window.
+    """
+    watcher = make_watcher(datasite_path, poll_interval=poll_interval)
+    participants = network_participants(datasite_path)
+    # participant -> config.json hash, a changed hash means new links to scrape
+    config_hashes = {participant: config_hash(datasite_path, participant)
+                     for participant in participants}
+    update_participants(participants, datasite_path,
+                        context, pipeline, workers, embed_batch_size)
+    print("Watching for participant changes..")
+    try:
+        while True:
+            changed = debounced_changes(watcher, debounce)
+            # deleted participants have nothing left to index
+            changed = sorted(participant for participant in changed
+                             if (Path(datasite_path) / participant).is_dir())
+            if not changed:
+                continue
+            rescrape = []
+            for participant in changed:
+                current_hash = config_hash(datasite_path, participant)
+                if current_hash != config_hashes.get(participant):
+                    rescrape.append(participant)
+                config_hashes[participant] = current_hash
+            print(f"Change detected for {changed}, rescraping {rescrape}")
+            try:
+                update_participants(changed, datasite_path, context, pipeline,
+                                    workers, embed_batch_size, rescrape=rescrape)
+            except Exception as e:
+                print(f"Update failed for {changed}: {type(e).__name__}: {e}")
+    finally:
+        watcher.close()
+
 
 def perform_query(query, participants: list[str], datasite_path: Path,
                   embed_model, llm, context):
@@ -197,19 +196,38 @@ def perform_query(query, participants: list[str], datasite_path: Path,
 
 # syftbox relevant main
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int,
+                        default=min(4, os.cpu_count() or 1),
+                        help="number of processes used to index participants")
+    parser.add_argument("--embed-batch-size", type=int, default=32,
+                        help="chunks embedded per model call")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and reindex participants as their files change")
+    parser.add_argument("--debounce", type=float, default=2.0,
+                        help="seconds without events before a batch of changes is processed")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="stat polling interval when inotify is unavailable")
+    args = parser.parse_args()
 
     # client and models loading
     client = Client.load()
     embed_model = BgeSmallEmbedModel()
     llm = OllamaLLM()  # T5LLM()
 
-    pipeline = IngestionPipeline(
-    transformations=[SentenceSplitter(
-        chunk_size=50, chunk_overlap=10), embed_model.embedding_model])
-    
-    global_context = create_context()
+    # same chunking as the app, see rag_utils.CHUNK_SIZE
+    pipeline = make_ingestion_pipeline(embed_model.embedding_model)
+
+    # the updater only encrypts, the public keys are enough
+    global_context = load_context(public_only=True)
     print(f"GLOBAL CONTEXT: {global_context}")
 
+    if args.daemon:
+        run_daemon(client.datasite_path.parent, global_context, pipeline,
+                   workers=args.workers, embed_batch_size=args.embed_batch_size,
+                   debounce=args.debounce, poll_interval=args.poll_interval)
+        exit()
+
     # Setup folder paths
     output_folder = client.datasite_path / "api_data" / \
         "federated_rag" / "timestamp_recorder"
@@ -232,5 +250,7 @@ if __name__ == "__main__":
         participants, 
         client.datasite_path.parent,
         context=global_context, 
-        pipeline=pipeline)
+        pipeline=pipeline,
+        workers=args.workers,
+        embed_batch_size=args.embed_batch_size)
     
\ No newline at end of file
@@ -6,16 +6,14 @@ from datetime import datetime
 import re
 
 from src.custom_utils.encryptors import create_context
+from src.custom_utils.context_store import load_context
 from src.lm_utils.embedding_models.base_embeds import BgeSmallEmbedModel
 from src.lm_utils.llms.base_lm import T5LLM, GeminiLLM, OllamaLLM
-from src.rag_utils import index_creator, load_query_engine
+from src.rag_utils import index_creator, load_query_engine, run_index_jobs, WarmQueryEngine
 
-from src.data_utils.linkedin_extractor import LinkedinScraper
-from src.data_utils.resume_extractor import pdf_to_text
-from src.data_utils.github_extractor import get_github_user_info
-from src.data_utils.google_scholar_extractor import google_scholar_extractor_util
-from src.data_utils.portfolio_extractor import extract_portfolio_data
-from src.utils import remove_emails_and_phone_numbers
+from src.data_utils.scrape_pipeline import (scrape_participants,
+                                            LINKEDIN, GITHUB, GOOGLE_SCHOLAR,
+                                            PORTFOLIO, RESUME)
 
 
 def should_run(output_file_path: str) -> bool:
@@ -46,20 +44,21 @@ def save_run(output_folder: str, output_file_path: str):
     print(f"Timestamp has been written to {output_file_path}")
 
 
-def make_index(participants: list[str], datasite_path: Path, context, pipeline):
+def make_index(participants: list[str], datasite_path: Path, context, pipeline,
+               workers=1, embed_batch_size=32):
     print("Computing indices")
-    indexes = {}
-    active_participants = []
+    jobs = []
     for user_folder in participants:
         value_file: Path = Path(datasite_path) / \
             user_folder / "public" / "bio.txt"
         if value_file.exists():
-            index = index_creator(value_file, target_path=Path(
-                datasite_path) / user_folder / "public", context=context, node_pipeline=pipeline)
-            indexes[user_folder] = index
-            active_participants.append(user_folder)
+            jobs.append((user_folder, value_file,
+                         Path(datasite_path) / user_folder / "public"))
+    active_participants = run_index_jobs(jobs, context=context,
+                                         node_pipeline=pipeline, workers=workers,
+                                         embed_batch_size=embed_batch_size)
     print("Found {} indices and the active participants are: {}".format(
-        len(indexes), active_participants))
+        len(active_participants), active_participants))
     return active_participants
 
 
@@ -81,17 +80,36 @@ def load_queries(input_query_folder: str):
 
 
 def perform_query(query, source,
-                  embed_model, llm, context):
-    midx_engine = load_query_engine(source,
-                                    embed_model=embed_model,
-                                    llm=llm, context=context)
+                  embed_model, llm, context, engine=None):
+    # engine : optional WarmQueryEngine, reused across queries instead of rebuilding
+    if engine is not None:
+        midx_engine = engine.get()
+    else:
+        midx_engine = load_query_engine(source,
+                                        embed_model=embed_model,
+                                        llm=llm, context=context)
     print("Engine ready for querying..")
     print("generating response!")
-    response = midx_engine.generate(query, top_k=3)
+    response = midx_engine.generate(query, top_k=3, llm=llm)
     print("Query was executed succesfully.")
     return response
 
 
+def perform_query_stream(query, source,
+                         embed_model, llm, context, engine=None):
+    # generator version of perform_query, yields the response chunk by chunk
+    if engine is not None:
+        midx_engine = engine.get()
+    else:
+        midx_engine = load_query_engine(source,
+                                        embed_model=embed_model,
+                                        llm=llm, context=context)
+    print("Engine ready for querying..")
+    print("streaming response!")
+    yield from midx_engine.generate_stream(query, top_k=3, llm=llm)
+    print("Query was executed succesfully.")
+
+
 def network_participants(datasite_path: Path):
     exclude_dir = ["apps", ".syft"]
 
@@ -148,92 +166,17 @@ def get_links_from_config(config_path: Path):
     return links
 
 
-def scrape_save_data(participants: list[str], datasite_path: Path):
-    for participant in participants:
-        participant_path = Path(datasite_path)/participant/"public"
-        participant_path.mkdir(parents=True, exist_ok=True)
-        bio_path = participant_path/"bio.txt"
-        if bio_path.exists():
-            print(
-                f"Skipping data extraction for {participant}: bio already exists")
-            continue
-        config_path = participant_path / "config.json"
-        links = get_links_from_config(config_path)
-        extracted_info = []
-
-        try:
-            if links['linkedin']:
-                try:
-                    linkedin_scraper = LinkedinScraper(user_email='', pwd='')
-                    profile_username = linkedin_scraper.get_profile_usr(
-                        links['linkedin'])
-                    profile_data = linkedin_scraper.scrape_profile(
-                        profile_username)
-
-                    extracted_info.append("# Linkedin Information:\n")
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(str(profile_data)))
-                except Exception as e:
-                    print(f"LinkedIn scraping failed for {participant}: {e}")
-
-            if links['github']:
-                try:
-                    git_data = get_github_user_info(links['github'])
-
-                    extracted_info.append('# Github Information:\n')
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(git_data))
-
-                except Exception as e:
-                    print(f"Github scraping failed for {participant}: {e}")
-
-            # TODO : add google scholar and portfolio extractor
-
-            if links['google_scholar']:
-                print(f"Google scholar url: {links['google_scholar']}")
-                try:
-                    gs_data = google_scholar_extractor_util(
-                        links["google_scholar"])
-
-                    extracted_info.append('# google_scholar: \n')
-                    extracted_info.append(gs_data)
-                except Exception as e:
-                    print(
-                        f"Google scholar extraction failed for {participant}: {e}")
-
-            if links['portfolio']:
-                print(f"portfolio url: {links['misc']}")
-                try:
-                    portfolio_data = extract_portfolio_data(
-                        links["misc"])
-
-                    extracted_info.append('# portfolio: \n')
-                    extracted_info.append(portfolio_data)
-                except Exception as e:
-                    print(
-                        f"portfolio extraction failed for {participant}: {e}")
-
-            if links['resume_path']:
-                print(f"RESUME PATH: {links['resume_path']}")
-                try:
-                    resume_data = pdf_to_text(links['resume_path'])
-
-                    extracted_info.append('# Resume: \n')
-                    extracted_info.append(
-                        remove_emails_and_phone_numbers(resume_data))
-                except Exception as e:
-                    print(f"Resume parsing failed for {participant}: {e}")
-
-            if len(extracted_info) > 0:
-                with open(bio_path, 'w', encoding='utf-8') as bio_file:
-                    bio_file.writelines(extracted_info)
-                    print(
-                        f"Successfully processed and saved bio for {participant}")
-            else:
-                print(f"No information found for {participant}")
-
-        except Exception as e:
-            print(f"Overall data extraction failed for {participant}: {e}")
+def scrape_save_data(participants: list[str], datasite_path: Path, max_workers=8):
+    # every source of every participant is scraped concurrently, see scrape_participants
+    active_participants, inactive_participants, _ = scrape_participants(
+        participants, datasite_path,
+        get_links=get_links_from_config,
+        sources=[LINKEDIN, GITHUB, GOOGLE_SCHOLAR, PORTFOLIO, RESUME],
+        max_workers=max_workers)
+    for participant in active_participants:
+        print(f"Successfully processed and saved bio for {participant}")
+    for participant in inactive_participants:
+        print(f"No information found for {participant}")
 
 
 if __name__ == "__main__":
@@ -201,8 +201,15 @@ else
     start_gradio
 fi
 
-# Run the index updater every 5 mins
-python3 index_updater.py > "logs/index_updater.log" 2>&1 &
+# Run the index updater as a daemon, it reindexes participants as their files change
+UPDATER_PID_FILE="index_updater_pid.txt"
+if [ -f "$UPDATER_PID_FILE" ] && ps -p "$(cat "$UPDATER_PID_FILE")" > /dev/null; then
+    log_message "Index updater is already running (PID: $(cat "$UPDATER_PID_FILE"))"
+else
+    python3 index_updater.py --daemon > "logs/index_updater.log" 2>&1 &
+    echo "$!" > "$UPDATER_PID_FILE"
+    log_message "Index updater started (PID: $(cat "$UPDATER_PID_FILE"))"
+fi
 
 # deactivate the virtual environment
 deactivate
\ No newline at end of file
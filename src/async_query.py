@@ -0,0 +1,85 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+class AsyncQueryPipeline:
+    """
+    Async front of a WarmQueryEngine so one process can serve concurrent users.
+    - retrieval (query embedding + CKKS scoring) runs on a dedicated worker pool
+    - llm streams are pulled chunk by chunk on a second pool and awaited
+    - at most `max_concurrency` queries run at once, later ones queue (FIFO)
+    Worker pools are threads: the heavy parts (torch, numpy, SEAL) run in native
+    code and the engine, keys and stacked matrices are shared instead of copied
+    into every worker.
+    """
+
+    def __init__(self, engine, max_concurrency=4, retrieval_workers=2,
+                 llm_workers=None):
+        self.engine = engine
+        self.max_concurrency = max_concurrency
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=retrieval_workers,
+                                                 thread_name_prefix="retrieval")
+        self.llm_pool = ThreadPoolExecutor(max_workers=llm_workers or max_concurrency,
+                                           thread_name_prefix="llm")
+        self._semaphore = None
+        self.waiting = 0
+        self.running = 0
+
+    @property
+    def semaphore(self):
+        # created lazily so it binds to the loop serving the requests
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _iterate(self, iterator):
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(self.llm_pool, next, iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+
+    async def stream(self, query, llm=None, top_k=3, sep="---------"):
+        self.waiting += 1
+        async with self.semaphore:
+            self.waiting -= 1
+            self.running += 1
+            try:
+                start = time.time()
+                loop = asyncio.get_running_loop()
+                composer = await loop.run_in_executor(self.retrieval_pool, self.engine.get)
+                response = await loop.run_in_executor(
+                    self.retrieval_pool, composer.cached_response, query, llm, top_k)
+                if response is not None:
+                    print("Serving response from semantic cache")
+                    yield response
+                    return
+
+                retrieved_out = await loop.run_in_executor(
+                    self.retrieval_pool, composer.enc_retriever, query, top_k)
+                print(f"Retrieval took {time.time() - start:.2f} seconds")
+                context = composer.build_context(retrieved_out, sep)
+                chunks = []
+                async for chunk in self._iterate(
+                        composer.stream_answer(context, query, llm=llm, start=start)):
+                    chunks.append(chunk)
+                    yield chunk
+                await loop.run_in_executor(self.retrieval_pool, composer.store_response,
+                                           query, "".join(chunks), llm, top_k)
+            finally:
+                self.running -= 1
+
+    async def answer(self, query, llm=None, top_k=3, sep="---------"):
+        return "".join([chunk async for chunk in self.stream(query, llm, top_k, sep)])
+
+    def stats(self):
+        return {"running": self.running, "waiting": self.waiting,
+                "max_concurrency": self.max_concurrency}
+
+    def shutdown(self):
+        self.retrieval_pool.shutdown(wait=False)
+        self.llm_pool.shutdown(wait=False)
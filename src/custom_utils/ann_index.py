@@ -0,0 +1,150 @@
+import os
+import hashlib
+import numpy as np
+
+
+def kmeans(matrix, n_clusters, n_iter=20, seed=0):
+    """
+    spherical k-means (dot product similarity, embeddings are normalized),
+    returns (centroids, assignment of every row).
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, len(matrix)))
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].copy()
+    assignments = np.zeros(len(matrix), dtype=np.int64)
+    for _ in range(n_iter):
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = matrix[assignments == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids, assignments
+
+
+def matrix_fingerprint(matrix):
+    digest = hashlib.sha256(str(matrix.shape).encode())
+    digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()
+
+
+class ExactSearch:
+    """ brute force scoring of every row, the default for small corpora """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, query, k):
+        # (candidate row indices, their scores)
+        return np.arange(len(self.matrix)), self.matrix @ query
+
+    def extended(self, matrix, start):
+        # search over matrix, whose rows from `start` on are new
+        return ExactSearch(matrix)
+
+
+class IVFFlatIndex:
+    """
+    Inverted file index over the stacked embedding matrix.
+    Rows are clustered into n_lists lists, a query scores the centroids and then
+    only the rows of its n_probe closest lists (exactly, hence "flat").
+    The matrix is not copied (it may be the memory-mapped stacked matrix), row_order
+    lists the rows list by list, list c being row_order[list_offsets[c]:list_offsets[c + 1]],
+    a query only gathers the rows of its probed lists.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+
+    def build(self, matrix):
+        self.n_lists = self.n_lists or max(1, int(np.sqrt(len(matrix))))
+        self.centroids, assignments = kmeans(matrix, self.n_lists, seed=self.seed)
+        self.n_lists = len(self.centroids)
+        self.set_lists(matrix, assignments)
+        self.fingerprint = matrix_fingerprint(matrix)
+        return self
+
+    def set_lists(self, matrix, assignments):
+        self.row_order = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.searchsorted(assignments[self.row_order],
+                                            np.arange(self.n_lists + 1))
+        self.matrix = matrix
+
+    def assignments(self):
+        assignments = np.empty(len(self.row_order), dtype=np.int64)
+        for c in range(self.n_lists):
+            assignments[self.row_order[self.list_offsets[c]:self.list_offsets[c + 1]]] = c
+        return assignments
+
+    def extended(self, matrix, start):
+        """
+        New index over matrix whose rows from `start` on are new : the new rows
+        join the list of their closest centroid, centroids are not retrained.
+        self is left untouched, queries in flight can keep using it.
+        """
+        index = IVFFlatIndex(n_lists=self.n_lists, n_probe=self.n_probe, seed=self.seed)
+        index.centroids = self.centroids
+        new_assignments = np.argmax(matrix[start:] @ self.centroids.T, axis=1) \
+            if len(matrix) > start else np.empty(0, dtype=np.int64)
+        index.set_lists(matrix, np.concatenate([self.assignments()[:start], new_assignments]))
+        index.fingerprint = matrix_fingerprint(matrix)
+        return index
+
+    def search(self, query, k):
+        centroid_scores = self.centroids @ query
+        probe_order = np.argsort(-centroid_scores)
+        # probe n_probe lists, more if they hold fewer than k rows in total
+        n_probe, n_candidates = 0, 0
+        while n_probe < self.n_lists and (n_probe < self.n_probe or n_candidates < k):
+            c = probe_order[n_probe]
+            n_candidates += self.list_offsets[c + 1] - self.list_offsets[c]
+            n_probe += 1
+        rows = np.concatenate([self.row_order[self.list_offsets[c]:self.list_offsets[c + 1]]
+                               for c in probe_order[:n_probe]])
+        # sorted rows read the (memory-mapped) matrix front to back
+        rows.sort()
+        return rows, self.matrix[rows] @ query
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, row_order=self.row_order,
+                 list_offsets=self.list_offsets, n_probe=self.n_probe,
+                 fingerprint=self.fingerprint)
+
+    @classmethod
+    def load(cls, path, matrix):
+        # None when the saved index was built over a different matrix
+        data = np.load(path)
+        if str(data["fingerprint"]) != matrix_fingerprint(matrix):
+            return None
+        index = cls(n_lists=len(data["centroids"]), n_probe=int(data["n_probe"]))
+        index.centroids = data["centroids"]
+        index.row_order = data["row_order"]
+        index.list_offsets = data["list_offsets"]
+        index.matrix = matrix
+        index.fingerprint = str(data["fingerprint"])
+        return index
+
+
+def build_ann_index(matrix, backend="auto", min_rows=20000, path=None, n_probe=8):
+    """
+    backend : "exact", "ivf" or "auto" (ivf from min_rows rows on).
+    path : optional .npz file the ivf index is loaded from / saved to.
+    """
+    if backend == "auto":
+        backend = "ivf" if len(matrix) >= min_rows else "exact"
+    if backend == "exact" or len(matrix) == 0:
+        return ExactSearch(matrix)
+
+    if path is not None and os.path.exists(path):
+        index = IVFFlatIndex.load(path, matrix)
+        if index is not None:
+            print(f"Loaded ANN index from {path}")
+            index.n_probe = n_probe
+            return index
+    print("Building ANN index..")
+    index = IVFFlatIndex(n_probe=n_probe).build(matrix)
+    if path is not None:
+        index.save(path)
+    return index
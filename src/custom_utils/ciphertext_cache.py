@@ -0,0 +1,114 @@
+import uuid
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import tenseal as ts
+
+
+class CiphertextCache:
+    """
+    LRU of deserialized CKKSVectors, bounded by a memory budget in bytes.
+    The serialized size of a ciphertext is used as its memory estimate, so memory
+    grows with the set of chunks actually scored instead of the whole network.
+    Scan resistant : a full scan larger than the budget (rowwise scoring of every
+    chunk) would evict each entry before its next use and miss on every row, so
+    scan accesses neither refresh recency nor evict, they are only admitted into
+    free space. Repeated scans then hit on the resident part (budget / scan size).
+    """
+
+    def __init__(self, context, max_bytes=512 * 2**20):
+        self.context = context
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def is_scan(self, n_rows):
+        # would n_rows ciphertexts overflow the budget (unknown size -> assume so)
+        with self._lock:
+            if not self.entries:
+                return True
+            return n_rows * self.size / len(self.entries) > self.max_bytes
+
+    def get(self, key, load_blob, scan=False):
+        with self._lock:
+            if key in self.entries:
+                if not scan:
+                    self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+        # deserialize outside the lock, concurrent queries scoring other rows don't wait
+        blob = load_blob()
+        vector = ts.ckks_vector_from(self.context, blob)
+        with self._lock:
+            self.misses += 1
+            if scan and self.size + len(blob) > self.max_bytes:
+                return vector
+            if key not in self.entries:
+                self.entries[key] = (vector, len(blob))
+                self.size += len(blob)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, n_bytes) = self.entries.popitem(last=False)
+                self.size -= n_bytes
+        return vector
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.entries), "bytes": self.size}
+
+
+class LazyCiphertextMatrix:
+    """
+    Sequence of ciphertexts deserialized on access through a CiphertextCache.
+    sources : list of (token, blob getter), a blob getter maps a row to serialized
+    bytes, e.g. EncryptedEmbeddingStore.blob. Row i lives at rows[i] of
+    sources[source_ids[i]]. Indexing with a slice / index array gives another
+    lazy matrix, nothing is deserialized until iteration or integer indexing.
+    """
+
+    def __init__(self, sources, source_ids, rows, cache):
+        self.sources = sources
+        self.source_ids = np.asarray(source_ids, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cache = cache
+
+    @classmethod
+    def from_blobs(cls, load_blob, rows, cache):
+        rows = np.asarray(rows, dtype=np.int64)
+        return cls([(uuid.uuid4().hex, load_blob)], np.zeros(len(rows)), rows, cache)
+
+    @classmethod
+    def concatenate(cls, matrices, cache):
+        sources, source_ids, rows = [], [], []
+        for matrix in matrices:
+            source_ids.append(matrix.source_ids + len(sources))
+            sources.extend(matrix.sources)
+            rows.append(matrix.rows)
+        if not rows:
+            return cls([], [], [], cache)
+        return cls(sources, np.concatenate(source_ids), np.concatenate(rows), cache)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, item, scan=False):
+        token, load_blob = self.sources[self.source_ids[item]]
+        row = int(self.rows[item])
+        return self.cache.get((token, row), lambda: load_blob(row), scan=scan)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.get(item)
+        return LazyCiphertextMatrix(self.sources, self.source_ids[item],
+                                    self.rows[item], self.cache)
+
+    def __iter__(self):
+        # iterating is scoring every row, scan mode when they don't fit the budget
+        scan = self.cache.is_scan(len(self))
+        for i in range(len(self)):
+            yield self.get(i, scan=scan)
@@ -0,0 +1,67 @@
+import os
+import fcntl
+import hashlib
+from pathlib import Path
+
+import tenseal as ts
+
+from src.custom_utils.encryptors import create_context
+
+DEFAULT_KEY_DIR = Path(os.path.expanduser("~")) / ".federated_rag" / "keys"
+SECRET_FILENAME = "ckks_secret.ctx"
+PUBLIC_FILENAME = "ckks_public.ctx"
+
+
+def _write_bytes(path, data, mode):
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_context(context, key_dir=DEFAULT_KEY_DIR):
+    """
+    secret context (secret + public + galois + relin keys) readable by the owner only,
+    public context next to it for processes that only encrypt, without the secret key
+    and without galois keys (they are only needed for rotations in dot products).
+    """
+    key_dir = Path(key_dir)
+    key_dir.mkdir(parents=True, exist_ok=True)
+    _write_bytes(key_dir / SECRET_FILENAME,
+                 context.serialize(save_secret_key=True), 0o600)
+    _write_bytes(key_dir / PUBLIC_FILENAME,
+                 context.serialize(save_secret_key=False, save_galois_keys=False), 0o644)
+
+
+def load_context(key_dir=DEFAULT_KEY_DIR, public_only=False):
+    """
+    Load the persisted CKKS context, generating and saving it on first use.
+    Every entry point shares these keys, so ciphertexts written by the index
+    updater can be scored and decrypted by the app.
+    public_only : skip the secret key, enough for processes that only encrypt.
+    """
+    key_dir = Path(key_dir)
+    secret_path = key_dir / SECRET_FILENAME
+    public_path = key_dir / PUBLIC_FILENAME
+    if public_only and public_path.exists():
+        return ts.context_from(public_path.read_bytes())
+
+    key_dir.mkdir(parents=True, exist_ok=True)
+    # first start of app + updater at the same time must not generate two key sets
+    with open(key_dir / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not secret_path.exists():
+            print(f"No CKKS keys found, generating new keys in {key_dir}")
+            save_context(create_context(), key_dir)
+
+    if public_only:
+        return ts.context_from(public_path.read_bytes())
+    return ts.context_from(secret_path.read_bytes())
+
+
+def context_key_id(context):
+    # short fingerprint of the public key, identifies which keys a ciphertext belongs to
+    public_key = context.serialize(save_public_key=True, save_secret_key=False,
+                                   save_galois_keys=False, save_relin_keys=False)
+    return hashlib.sha256(public_key).hexdigest()[:16]
@@ -5,121 +5,386 @@ from llama_index.core import (
     StorageContext, load_index_from_storage
 )
 
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
 from src.custom_utils.custom_index import CustomIndex
+from src.custom_utils.embedding_shard import has_embedding_shard
+from src.custom_utils.ciphertext_cache import CiphertextCache, LazyCiphertextMatrix
+from src.custom_utils.context_store import context_key_id
+from src.custom_utils.ann_index import build_ann_index, ExactSearch
+from src.custom_utils.top_k import select_top_k
+from src.pageview_writer import default_pageview_writer
 # TODO : Parth : Implement this file
 from src.custom_utils.encryptors import (encrypt_embeddings,
                                          decrypt_embeddings,
-                                         encrypted_dot_product)
+                                         encrypted_dot_product,
+                                         packed_dot_product)
 
 
-import json
 import os
+import copy
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 
 
 class GraphComposer:
     def __init__(self, indexes_folder_paths: list,
                  embedding_model,
-                 llm, context):
+                 llm, context,
+                 encrypted_mode="auto", packed_min_rows=160, two_stage_probe=4,
+                 ann_backend="auto", ann_min_rows=20000, ann_path=None, ann_n_probe=8,
+                 embedding_dtype=np.float32, matrix_path=None, trace_memory=False,
+                 ciphertext_cache_bytes=512 * 2**20, pageview_writer=None,
+                 min_score=None, max_chunks_per_participant=None):
         self.indexes_folder_paths = indexes_folder_paths
+        # embedding_dtype : dtype of the stacked plaintext matrix (float32 or float16)
+        # matrix_path : optional .npy, the stacked matrix is written there and memory mapped
+        # trace_memory : report the tracemalloc peak of compose_indexes
+        self.embedding_dtype = embedding_dtype
+        self.matrix_path = matrix_path
+        self.trace_memory = trace_memory
+        # chunk ciphertexts are deserialized lazily, at most ~ciphertext_cache_bytes kept
+        self.ciphertext_cache = CiphertextCache(context, max_bytes=ciphertext_cache_bytes)
+        # encrypted_mode : "rowwise" -> one ciphertext dot + decrypt per chunk
+        #                  "packed"  -> encrypted query x plaintext blocks of ~4k rows,
+        #                               one vector-matrix product + decrypt per block
+        #                  "two_stage" -> score the encrypted cluster centroids first, then
+        #                               rowwise only the chunks of the two_stage_probe
+        #                               best clusters (+ chunks of indexes without centroids)
+        #                  "auto"    -> packed once there are packed_min_rows chunks
+        #                               (~crossover, a block costs as much as ~140
+        #                               rowwise chunks, see bench_packed_ckks.py)
+        self.encrypted_mode = encrypted_mode
+        self.packed_min_rows = packed_min_rows
+        self.two_stage_probe = two_stage_probe
+        # ann_backend : plaintext retriever search, "exact", "ivf" (approximate, probes
+        #               ann_n_probe clusters) or "auto" -> ivf from ann_min_rows chunks
+        #               ann_path : .npz the ivf index is persisted to
+        self.ann_backend = ann_backend
+        self.ann_min_rows = ann_min_rows
+        self.ann_path = ann_path
+        self.ann_n_probe = ann_n_probe
+        # retrieved chunks : sorted by score, none below min_score and at most
+        # max_chunks_per_participant from a single participant (None -> no limit)
+        self.min_score = min_score
+        self.max_chunks_per_participant = max_chunks_per_participant
+        # page views are counted in memory and flushed in the background
+        self.pageview_writer = pageview_writer or default_pageview_writer()
+        # set by WarmQueryEngine : answers are only cached against a known index version
+        self.response_cache = None
+        self.index_version = None
         # embedding mdoel has to be a HuggingFaceEmbedding class for Settings to function
         self.embedding_model = embedding_model
         self.llm = llm
         self.context = context
+        # cached encrypted queries are only valid for the keys they were made with
+        self.context_key_id = context_key_id(context)
         # setting again might not be required, as Settings.embed_model works globally
         Settings.embed_model = embedding_model.embedding_model
         self.compose_indexes()
         # Setting.llm not required as we are not using llamaindex for inference/generation.
 
     def load_from_disk(self, persist_dir):
+        if has_embedding_shard(persist_dir):
+            # docstore only, embeddings come from the memory mapped shard
+            # instead of parsing default__vector_store.json
+            storage_context = StorageContext.from_defaults(
+                docstore=SimpleDocumentStore.from_persist_dir(str(persist_dir)))
+            return None, storage_context
         storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
         base_index = load_index_from_storage(storage_context)
         return base_index, storage_context
 
+    def load_index(self, index_folder):
+        base_index, storage_context = self.load_from_disk(index_folder)
+        return CustomIndex(
+            base_index, storage_context, index_folder,
+            encryption_context=self.context,
+            embedding_dtype=self.embedding_dtype,
+            ciphertext_cache=self.ciphertext_cache)
+
     def compose_indexes(self):
-        indexes = []
-        for index_folder in self.indexes_folder_paths:
-            base_index, storage_context = self.load_from_disk(index_folder)
-            custom_index = CustomIndex(
-                base_index, storage_context, index_folder,
-                encryption_context=self.context)
-            indexes.append(custom_index)
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        indexes = [self.load_index(index_folder)
+                   for index_folder in self.indexes_folder_paths]
 
         self.stack_info(indexes)
 
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"Compose memory : current {current / 2**20:.1f} MB, "
+                  f"peak {peak / 2**20:.1f} MB")
+            if started_tracing:
+                tracemalloc.stop()
+
+    def allocate_matrix(self, shape):
+        if self.matrix_path is None or shape[0] == 0:
+            return np.empty(shape, dtype=self.embedding_dtype)
+        # written next to matrix_path and renamed over it once filled, a snapshot
+        # still mapping the previous file keeps reading its own inode
+        return np.lib.format.open_memmap(f"{self.matrix_path}.{os.getpid()}.tmp",
+                                         mode="w+", dtype=self.embedding_dtype,
+                                         shape=shape)
+
     def stack_info(self, indexes):
         # makes enc and non-enc vectors matrix for across all persons folder
-        self.global_encrypted_embedding_matrix = []
-        self.global_unencrypted_embedding_matrix = []
+        self.global_unencrypted_embedding_matrix = np.empty((0, 0), dtype=self.embedding_dtype)
+        self.global_encrypted_embedding_matrix = LazyCiphertextMatrix(
+            [], [], [], self.ciphertext_cache)
+        # index folder -> (start, end) rows, participant_rows() slices are views
+        self.participant_row_ranges = {}
+        # False for rows of dropped participants, they are never returned
+        self.row_mask = np.ones(0, dtype=bool)
+        self.n_tombstoned = 0
+        # participant of every row (first row of its range, unique per loaded index)
+        self.row_participant = np.empty(0, dtype=np.int64)
         self.global_node_info = []
         self.global_text_info = []
         self.global_extra_info = []
+        # participant id and prompt ready snippet of every row, object arrays so a
+        # top k is gathered with one fancy index
+        self.global_participant_info = np.empty(0, dtype=object)
+        self.global_snippet_info = np.empty(0, dtype=object)
+        # two stage retrieval : encrypted centroids, global rows of every centroid
+        # and rows that belong to no centroid (always scored)
+        self.global_encrypted_centroids = []
+        self.centroid_members = []
+        self.uncentered_rows = []
+        self.append_indexes(indexes)
+
+        if isinstance(self.global_unencrypted_embedding_matrix, np.memmap):
+            # reopen read only, the pages are shared through the page cache
+            self.global_unencrypted_embedding_matrix.flush()
+            os.replace(self.global_unencrypted_embedding_matrix.filename, self.matrix_path)
+            self.global_unencrypted_embedding_matrix = np.load(self.matrix_path,
+                                                               mmap_mode="r")
 
+        self.ann_index = build_ann_index(
+            self.global_unencrypted_embedding_matrix, backend=self.ann_backend,
+            min_rows=self.ann_min_rows, path=self.ann_path, n_probe=self.ann_n_probe)
+
+    def append_indexes(self, indexes):
+        """
+        Appends the rows of `indexes` after the current rows.
+        Every container is replaced by a new one instead of being extended in place,
+        so a snapshot sharing the previous containers is never modified.
+        """
+        old_rows = len(self.global_node_info)
+        n_rows = old_rows + sum(len(index.node_info) for index in indexes)
+        dim = max([self.global_unencrypted_embedding_matrix.shape[1]] +
+                  [index.unencrypted_embedding_matrix.shape[1]
+                   for index in indexes if len(index.node_info)])
+        # one preallocated contiguous matrix, every index is copied into its row range
+        # (memory mapped only for a fresh compose, a live snapshot may map the file)
+        matrix = self.allocate_matrix((n_rows, dim)) if old_rows == 0 else \
+            np.empty((n_rows, dim), dtype=self.embedding_dtype)
+        if old_rows:
+            matrix[:old_rows] = self.global_unencrypted_embedding_matrix
+
+        participant_row_ranges = dict(self.participant_row_ranges)
+        node_info = list(self.global_node_info)
+        text_info = list(self.global_text_info)
+        extra_info = list(self.global_extra_info)
+        encrypted_centroids = list(self.global_encrypted_centroids)
+        centroid_members = list(self.centroid_members)
+        uncentered_rows = list(self.uncentered_rows)
+
+        offset = old_rows
         for index in indexes:
-            self.global_encrypted_embedding_matrix.extend(
-                index.encrypted_embedding_matrix)
-            self.global_unencrypted_embedding_matrix.extend(
-                index.unencrypted_embedding_matrix)
-            self.global_node_info.extend(index.node_info)
-            self.global_text_info.extend(index.text_info)
-            self.global_extra_info.extend(index.extra_info)
-
-        self.global_unencrypted_embedding_matrix = np.array(
-            self.global_unencrypted_embedding_matrix)
-        self.global_encrypted_embedding_matrix = np.array(
-            self.global_encrypted_embedding_matrix)
-
-    def write_stats(self, fname):
-        current_pageviews = {"views": 1}
-        if os.path.exists(fname):
-            print("Page views are loaded and updated")
-            in_file = open(fname, "r")
-            in_file = in_file.read().strip()
-            if in_file:
-                current_pageviews = json.load(open(fname, "r"))
-                current_pageviews['views'] += 1
-        with open(fname, "w") as f:
-            json.dump(current_pageviews, f)
-        print("Page views have been written successfully")
+            end = offset + len(index.node_info)
+            participant_row_ranges[str(index.base_index_folder)] = (offset, end)
+            if end > offset:
+                matrix[offset:end] = index.unencrypted_embedding_matrix
+            node_info.extend(index.node_info)
+            text_info.extend(index.text_info)
+            extra_info.extend(index.extra_info)
 
-    def enc_retriever(self, query, top_k=3):
-        # get query embeds
-        top_k = min(top_k, len(self.global_encrypted_embedding_matrix))
-        query_embedding = self.embedding_model.embed_data(query)
+            for c in range(len(index.enc_centroids)):
+                centroid_members.append(
+                    offset + np.flatnonzero(index.centroid_info == c))
+            encrypted_centroids.extend(index.enc_centroids)
+            uncentered_rows.extend(
+                (offset + np.flatnonzero(index.centroid_info == -1)).tolist())
+            offset = end
+
+        self.global_unencrypted_embedding_matrix = matrix
+        self.global_encrypted_embedding_matrix = LazyCiphertextMatrix.concatenate(
+            [self.global_encrypted_embedding_matrix] +
+            [index.encrypted_embedding_matrix for index in indexes], self.ciphertext_cache)
+        self.participant_row_ranges = participant_row_ranges
+        self.row_mask = np.concatenate([self.row_mask,
+                                        np.ones(n_rows - old_rows, dtype=bool)])
+        self.row_participant = np.concatenate(
+            [self.row_participant] + [np.full(end - start, start, dtype=np.int64)
+                                      for start, end in (participant_row_ranges[
+                                          str(index.base_index_folder)] for index in indexes)])
+        self.global_node_info = node_info
+        self.global_text_info = text_info
+        self.global_extra_info = extra_info
+        self.global_participant_info = np.concatenate(
+            [self.global_participant_info] +
+            [np.array(index.participant_info, dtype=object) for index in indexes])
+        self.global_snippet_info = np.concatenate(
+            [self.global_snippet_info] +
+            [np.array(index.snippet_info, dtype=object) for index in indexes])
+        self.global_encrypted_centroids = encrypted_centroids
+        self.centroid_members = centroid_members
+        self.uncentered_rows = uncentered_rows
+
+    def add_participant(self, index_folder):
+        """
+        Returns a new composer snapshot with the index of index_folder appended.
+        Other participants are not reloaded and self is not modified, queries
+        running on self finish on it, the caller swaps in the returned snapshot.
+        """
+        snapshot = copy.copy(self)
+        start = len(self.global_node_info)
+        snapshot.append_indexes([self.load_index(index_folder)])
+        snapshot.indexes_folder_paths = list(self.indexes_folder_paths) + [index_folder]
+        if isinstance(self.ann_index, ExactSearch):
+            # may switch to ivf once the corpus crosses ann_min_rows
+            snapshot.ann_index = build_ann_index(
+                snapshot.global_unencrypted_embedding_matrix, backend=self.ann_backend,
+                min_rows=self.ann_min_rows, n_probe=self.ann_n_probe)
+        else:
+            snapshot.ann_index = self.ann_index.extended(
+                snapshot.global_unencrypted_embedding_matrix, start)
+        return snapshot
+
+    def remove_participant(self, index_folder):
+        # new snapshot with the participant's rows tombstoned, no matrix is copied
+        snapshot = copy.copy(self)
+        snapshot.row_mask = self.row_mask.copy()
+        snapshot.drop_participant(index_folder)
+        snapshot.participant_row_ranges = {
+            folder: rows for folder, rows in self.participant_row_ranges.items()
+            if folder != str(index_folder)}
+        snapshot.indexes_folder_paths = [folder for folder in self.indexes_folder_paths
+                                         if str(folder) != str(index_folder)]
+        return snapshot
+
+    def replace_participant(self, index_folder):
+        # reloads one participant : old rows tombstoned, new rows appended
+        return self.remove_participant(index_folder).add_participant(index_folder)
+
+    def participant_rows(self, index_folder):
+        # view on one participant's rows of the plaintext matrix, no copy
+        start, end = self.participant_row_ranges[str(index_folder)]
+        return self.global_unencrypted_embedding_matrix[start:end]
+
+    def drop_participant(self, index_folder):
+        # tombstones the participant's rows instead of rebuilding the matrices
+        start, end = self.participant_row_ranges[str(index_folder)]
+        self.n_tombstoned += int(self.row_mask[start:end].sum())
+        self.row_mask[start:end] = False
+
+    def live_rows(self):
+        return len(self.row_mask) - self.n_tombstoned
+
+    def apply_tombstones(self, similarity_scores, indices=None):
+        # indices : rows the scores belong to, all rows when None
+        if self.n_tombstoned:
+            mask = self.row_mask if indices is None else self.row_mask[indices]
+            similarity_scores = np.where(mask, similarity_scores, -np.inf)
+        return similarity_scores
+
+    def select_top_k(self, similarity_scores, top_k, indices=None):
+        """
+        Sorted best rows (score order), indices : rows the scores belong to,
+        all rows when None. Applies min_score and max_chunks_per_participant.
+        """
+        groups = self.row_participant if indices is None else self.row_participant[indices]
+        selected = select_top_k(similarity_scores, top_k, min_score=self.min_score,
+                                groups=groups, max_per_group=self.max_chunks_per_participant)
+        return selected if indices is None else indices[selected]
+
+    def two_stage_similarity(self, encrypted_query_embedding, top_k=3):
+        """
+        Coarse stage : one ciphertext dot product per centroid, the best
+        two_stage_probe clusters (more if they hold fewer than top_k chunks) give
+        the candidates. Fine stage : rowwise scoring of the candidates only,
+        every other chunk gets -inf.
+        """
+        candidates = list(self.uncentered_rows)
+        if self.global_encrypted_centroids:
+            centroid_scores = encrypted_dot_product(
+                encrypted_query_embedding, self.global_encrypted_centroids).reshape(-1,)
+            probe_order = np.argsort(-centroid_scores)
+            n_probe = 0
+            while n_probe < len(probe_order) and (
+                    n_probe < self.two_stage_probe or len(candidates) < top_k):
+                candidates.extend(self.centroid_members[probe_order[n_probe]].tolist())
+                n_probe += 1
+        candidates = np.array(candidates, dtype=np.int64)
+
+        similarity_scores = np.full(len(self.global_encrypted_embedding_matrix), -np.inf)
+        if len(candidates):
+            similarity_scores[candidates] = encrypted_dot_product(
+                encrypted_query_embedding,
+                self.global_encrypted_embedding_matrix[candidates]).reshape(-1,)
+        return similarity_scores
+
+    def use_packed(self):
+        if self.encrypted_mode == "auto":
+            return len(self.global_unencrypted_embedding_matrix) >= self.packed_min_rows
+        return self.encrypted_mode == "packed"
+
+    def encrypted_similarity(self, query, query_embedding, top_k=3):
         # encrypt query embeds
-        encrypted_query_embedding = encrypt_embeddings(
-            query_embedding, context=self.context)
+        encrypted_query_embedding = self.embedding_model.cached_artifact(
+            query, ("ckks", self.context_key_id),
+            lambda: encrypt_embeddings(query_embedding, context=self.context))
 
         # apply distance/sim metric
-        similarity_scores = encrypted_dot_product(
-            encrypted_query_embedding, self.global_encrypted_embedding_matrix).reshape(-1,)
-        # select top_k
-        top_k_indices = np.argpartition(similarity_scores, -top_k)[-top_k:]
+        if self.use_packed():
+            similarity_scores = packed_dot_product(
+                encrypted_query_embedding, self.global_unencrypted_embedding_matrix,
+                self.context)
+        elif self.encrypted_mode == "two_stage":
+            similarity_scores = self.two_stage_similarity(
+                encrypted_query_embedding, top_k)
+        else:
+            similarity_scores = encrypted_dot_product(
+                encrypted_query_embedding,
+                self.global_encrypted_embedding_matrix).reshape(-1,)
+        return similarity_scores, encrypted_query_embedding
 
-        # collect text-info
-        collected_text_info = []
-        top_k_node_ids = []
-
-        # Current topK metadata
-        top_k_metadata = []
-        for i in top_k_indices:
-            identifier = self.global_node_info[i].metadata['file_path'].split(os.sep+"public")[
-                0].split(os.sep)[-1]
-            identifier = "Name of the person :" + identifier + "\n"
-            text_blob = identifier + "Info of the person:\n" + \
-                self.global_text_info[i].replace("\n\n\n", "")
-            collected_text_info.append(text_blob)
-            top_k_node_ids.append(self.global_node_info[i])
-
-            # Fetch the current meta data from the meta data inside the filapath
-            current_metadata = self.global_node_info[i].metadata['file_path']
-            top_k_metadata.append(current_metadata)
+    def collect_text_info(self, top_k_indices, identifier_prefix):
+        # snippets are built at compose time, only the prefix is added per query
+        collected_text_info = [identifier_prefix + snippet
+                               for snippet in self.global_snippet_info[top_k_indices]]
+        top_k_node_ids = [self.global_node_info[i] for i in top_k_indices]
+        return collected_text_info, top_k_node_ids
 
+    def record_pageviews(self, top_k_indices):
         # Set of topK files (unique per user)
-        top_k_metadata = list(set(top_k_metadata))
+        top_k_metadata = list(set(self.global_node_info[i].metadata['file_path']
+                                  for i in top_k_indices))
         for metadata in top_k_metadata:
             stats_fpath = metadata.split("bio.txt")[0]
             stats_fpath = os.path.join(stats_fpath, "pageviews.json")
-            self.write_stats(stats_fpath)
+            self.pageview_writer.increment(stats_fpath)
+
+    def enc_retriever(self, query, top_k=3):
+        # get query embeds
+        top_k = min(top_k, self.live_rows())
+        query_embedding = self.embedding_model.embed_data(query)
+        similarity_scores, encrypted_query_embedding = self.encrypted_similarity(
+            query, query_embedding, top_k)
+        similarity_scores = self.apply_tombstones(similarity_scores)
+        # select top_k, best first
+        top_k_indices = self.select_top_k(similarity_scores, top_k)
+
+        # collect text-info
+        collected_text_info, top_k_node_ids = self.collect_text_info(
+            top_k_indices, "Name of the person :")
+        self.record_pageviews(top_k_indices)
 
         return {
             "query": query,
@@ -133,26 +398,26 @@ class GraphComposer:
 
     def retriever(self, query, top_k=3):
         # get query embeds
-        top_k = min(top_k, self.global_unencrypted_embedding_matrix.shape[1])
+        top_k = min(top_k, self.live_rows())
 
         query_embedding = self.embedding_model.embed_data(query)
 
-        similarity_scores = np.dot(self.global_unencrypted_embedding_matrix,
-                                   query_embedding).reshape(-1,)
-        # select top_k
-        top_k_indices = np.argpartition(similarity_scores, -top_k)[-top_k:]
+        # exact backend scores every chunk, ivf only the chunks of the probed clusters
+        # (query cast to the matrix dtype, so the matrix is never upcast per query)
+        candidate_indices, candidate_scores = self.ann_index.search(
+            np.asarray(query_embedding, dtype=self.embedding_dtype).reshape(-1,), top_k)
+        candidate_scores = self.apply_tombstones(candidate_scores, candidate_indices)
+        if len(candidate_scores) == len(self.global_unencrypted_embedding_matrix):
+            similarity_scores = candidate_scores
+        else:
+            similarity_scores = np.full(len(self.global_unencrypted_embedding_matrix), -np.inf)
+            similarity_scores[candidate_indices] = candidate_scores
+        # select top_k, best first
+        top_k_indices = self.select_top_k(candidate_scores, top_k, candidate_indices)
 
         # collect text-info
-        collected_text_info = []
-        top_k_node_ids = []
-        for i in top_k_indices:
-            identifier = self.global_node_info[i].metadata['file_path'].split(os.sep+"public")[
-                0].split(os.sep)[-1]
-            identifier = "This text belong to :" + identifier + "\n"
-            text_blob = identifier + "Info of the person:\n" + \
-                self.global_text_info[i].replace("\n\n\n", "")
-            collected_text_info.append(text_blob)
-            top_k_node_ids.append(self.global_node_info[i])
+        collected_text_info, top_k_node_ids = self.collect_text_info(
+            top_k_indices, "This text belong to :")
 
         return {
             "query": query,
@@ -164,9 +429,136 @@ class GraphComposer:
             "top_k_node_ids": top_k_node_ids
         }
 
-    def generate(self, query, top_k=3, sep="---------"):
+    def retrieve_many(self, queries, top_k=3, encrypted=True, record_stats=True):
+        """
+        Retrieval for a batch of queries.
+        Queries are embedded through embed_many (cached ones skip the model), the
+        plaintext path scores them with a single (queries x dim) @ (dim x chunks)
+        matmul, the encrypted path runs the (packed) ciphertext scoring per query.
+        """
+        if not queries:
+            return []
+        top_k = min(top_k, self.live_rows())
+        query_embeddings = self.embedding_model.embed_many(queries)
+        if encrypted:
+            scored = [self.encrypted_similarity(query, query_embedding, top_k)
+                      for query, query_embedding in zip(queries, query_embeddings)]
+            similarity_scores = np.array([scores for scores, _ in scored]).reshape(
+                len(queries), -1)
+            identifier_prefix = "Name of the person :"
+        else:
+            similarity_scores = np.asarray(query_embeddings, dtype=self.embedding_dtype) @ \
+                self.global_unencrypted_embedding_matrix.T
+            identifier_prefix = "This text belong to :"
+        similarity_scores = self.apply_tombstones(similarity_scores)
+        # select top_k of every query, best first
+        top_k_indices = [self.select_top_k(scores, top_k) for scores in similarity_scores]
+
+        results = []
+        for i, query in enumerate(queries):
+            collected_text_info, top_k_node_ids = self.collect_text_info(
+                top_k_indices[i], identifier_prefix)
+            if encrypted and record_stats:
+                self.record_pageviews(top_k_indices[i])
+            results.append({
+                "query": query,
+                "collected_text_info": collected_text_info,
+                "query_embedding": query_embeddings[i],
+                "similarity_scores": similarity_scores[i],
+                "top_k_indices": top_k_indices[i],
+                "top_k_node_ids": top_k_node_ids
+            })
+        return results
+
+    def response_scope(self, llm, top_k):
+        return f"{llm.model_name}:{top_k}"
+
+    def cached_response(self, query, llm=None, top_k=3):
+        # earlier answer to the same or a paraphrased question, None on miss
+        if self.response_cache is None or self.index_version is None:
+            return None
+        llm = llm or self.llm
+        return self.response_cache.lookup(self.embedding_model.embed_data(query),
+                                          self.index_version,
+                                          self.response_scope(llm, top_k))
+
+    def store_response(self, query, response, llm=None, top_k=3):
+        if self.response_cache is None or self.index_version is None:
+            return
+        llm = llm or self.llm
+        response = llm.cacheable_response(response)
+        self.response_cache.store(query, self.embedding_model.embed_data(query), response,
+                                  self.index_version, self.response_scope(llm, top_k))
+
+    def generate(self, query, top_k=3, sep="---------", llm=None):
+        # llm can be overridden per call so one warm engine serves every model choice
+        llm = llm or self.llm
+        response = self.cached_response(query, llm, top_k)
+        if response is not None:
+            print("Serving response from semantic cache")
+            return response
         retrieved_out = self.enc_retriever(query, top_k)
         collected_text_info = retrieved_out["collected_text_info"]
         context = f"\n{sep}\n".join(collected_text_info)
-        response = self.llm.generate_response(context, query)
+        response = llm.generate_response(context, query)
+        self.store_response(query, response, llm, top_k)
         return response
+
+    def build_context(self, retrieved_out, sep="---------"):
+        return f"\n{sep}\n".join(retrieved_out["collected_text_info"])
+
+    def stream_answer(self, context, query, llm=None, start=None):
+        # yields llm chunks, logs time to first token and total latency from `start`
+        llm = llm or self.llm
+        start = start or time.time()
+        first_token_time = None
+        for chunk in llm.stream_response(context, query):
+            if first_token_time is None and chunk:
+                first_token_time = time.time() - start
+                print(f"Time to first token : {first_token_time:.2f} seconds")
+            yield chunk
+        print(f"Total response time : {time.time() - start:.2f} seconds")
+
+    def generate_stream(self, query, top_k=3, sep="---------", llm=None):
+        """
+        Same as generate but yields the answer chunk by chunk as the llm produces it.
+        Retrieval time, time to first token and total latency are logged separately.
+        """
+        response = self.cached_response(query, llm, top_k)
+        if response is not None:
+            print("Serving response from semantic cache")
+            yield response
+            return
+        start = time.time()
+        retrieved_out = self.enc_retriever(query, top_k)
+        print(f"Retrieval took {time.time() - start:.2f} seconds")
+        context = self.build_context(retrieved_out, sep)
+        chunks = []
+        for chunk in self.stream_answer(context, query, llm=llm, start=start):
+            chunks.append(chunk)
+            yield chunk
+        self.store_response(query, "".join(chunks), llm, top_k)
+
+    def generate_many(self, queries, top_k=3, sep="---------", llm=None,
+                      encrypted=True, max_workers=1):
+        """
+        Batched generate : retrieval for all queries via retrieve_many, then one llm
+        call per query, dispatched on max_workers threads when max_workers > 1.
+        Returns per query dicts with the top-k indices, the context and the response.
+        """
+        llm = llm or self.llm
+        results = self.retrieve_many(queries, top_k=top_k, encrypted=encrypted)
+        for result in results:
+            result["context"] = f"\n{sep}\n".join(result["collected_text_info"])
+
+        def answer(result):
+            return llm.generate_response(result["context"], result["query"])
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                responses = list(executor.map(answer, results))
+        else:
+            responses = [answer(result) for result in results]
+        for result, response in zip(results, responses):
+            result["response"] = response
+        return results
@@ -1,17 +1,34 @@
 import os
-import json
 import base64
 import numpy as np
-from ast import literal_eval
 import tenseal as ts
 
+from src.custom_utils.encrypted_store import (EncryptedEmbeddingStore,
+                                              read_legacy_encrypted_embeddings,
+                                              LEGACY_FILENAME,
+                                              CENTROIDS_FILENAME)
+from src.custom_utils.embedding_shard import has_embedding_shard, load_embedding_shard
+from src.custom_utils.ciphertext_cache import CiphertextCache, LazyCiphertextMatrix
+
+
+def participant_id(file_path):
+    # datasites/<participant>/public/bio.txt -> <participant>
+    return file_path.split(os.sep + "public")[0].split(os.sep)[-1]
+
+
+def prompt_snippet(participant, text):
+    # chunk as it goes in the llm context, the caller only adds its prefix
+    return participant + "\n" + "Info of the person:\n" + text.replace("\n\n\n", "")
+
 
 class CustomIndex:
     def __init__(self, base_index, storage_context,
                  base_index_folder,
                  encryption_context,
                  # ideally this would be name of corresponding encrypted embeds
-                 default_enc_filename="encrypted__vector_store.json",
+                 default_enc_filename="encrypted__vector_store.bin",
+                 embedding_dtype=np.float32,
+                 ciphertext_cache=None,
                  ):
         self.base_index = base_index
         self.base_index_folder = base_index_folder
@@ -20,40 +37,95 @@ class CustomIndex:
         self.vector_store = self.storage_context.vector_store
         self.docstore = self.storage_context.docstore
         self.default_enc_filename = default_enc_filename
+        self.embedding_dtype = embedding_dtype
+        # deserialized ciphertexts, usually shared by every index of a GraphComposer
+        self.ciphertext_cache = ciphertext_cache or CiphertextCache(encryption_context)
         self.load_encrypted_embeddings()
+        self.load_encrypted_centroids()
         self.stack_info()
 
     def load_encrypted_embeddings(self):
+        """
+        Only opens the encrypted store, ciphertexts are deserialized on first
+        access through the ciphertext cache (see LazyCiphertextMatrix).
+        enc_row_of : node id -> row in the store, load_blob : row -> serialized bytes
+        """
         file_path = os.path.join(
             self.base_index_folder, self.default_enc_filename)
-        self.enc_embeds_store = {}
-        with open(file_path, 'r') as f:
-            loaded_data = json.load(f)
+        if not os.path.exists(file_path):
+            # indexes written before the binary container existed, kept serialized in memory
+            encrypted_embeddings = read_legacy_encrypted_embeddings(
+                os.path.join(self.base_index_folder, LEGACY_FILENAME))
+            self.enc_store = None
+            self.enc_row_of = {key: row for row, key in enumerate(encrypted_embeddings)}
+            self.load_blob = list(encrypted_embeddings.values()).__getitem__
+            return
+
+        # stays open (memory mapped) for the lifetime of the index
+        self.enc_store = EncryptedEmbeddingStore(file_path)
+        self.enc_row_of = self.enc_store.key_to_row
+        self.load_blob = self.enc_store.blob
+
+    def load_encrypted_centroids(self):
+        # coarse stage of two stage retrieval, absent for indexes built before it
+        file_path = os.path.join(self.base_index_folder, CENTROIDS_FILENAME)
+        self.enc_centroids = []
+        self.centroid_assignments = {}
+        if not os.path.exists(file_path):
+            return
 
-        encrypted_embeddings = literal_eval(loaded_data["embedding_dict"])
+        with EncryptedEmbeddingStore(file_path) as store:
+            for key, value in store.items():
+                self.enc_centroids.append(ts.ckks_vector_from(
+                    self.encryption_context, value))
+            # node id -> position of its centroid in enc_centroids
+            self.centroid_assignments = {
+                node_id: store.key_to_row[key]
+                for node_id, key in store.meta.get("assignments", {}).items()}
 
-        for key, value in encrypted_embeddings.items():
-            value = ts.ckks_vector_from(self.encryption_context, value)
-            self.enc_embeds_store[key] = value
+    def embedding_rows(self):
+        """
+        (node ids, plaintext matrix or None) : from the memory mapped shard when
+        the index has one, else from the llama_index vector store (matrix None).
+        """
+        if has_embedding_shard(self.base_index_folder):
+            return load_embedding_shard(self.base_index_folder)
+        return list(self.vector_store.data.embedding_dict.keys()), None
 
     def stack_info(self):
         # makes enc and non-enc vectors matrix for each person folder
-        self.encrypted_embedding_matrix = []
-        self.unencrypted_embedding_matrix = []
+        node_ids, shard_matrix = self.embedding_rows()
+        n_rows = len(node_ids)
+        if shard_matrix is not None:
+            # no copy when the shard already has the wanted dtype
+            self.unencrypted_embedding_matrix = shard_matrix.astype(
+                self.embedding_dtype, copy=False)
+        else:
+            embedding_dict = self.vector_store.data.embedding_dict
+            dim = len(embedding_dict[node_ids[0]]) if n_rows else 0
+            # rows are written into preallocated arrays, no intermediate lists
+            self.unencrypted_embedding_matrix = np.empty(
+                (n_rows, dim), dtype=self.embedding_dtype)
+            for row, node_id in enumerate(node_ids):
+                self.unencrypted_embedding_matrix[row] = embedding_dict[node_id]
+        self.encrypted_embedding_matrix = LazyCiphertextMatrix.from_blobs(
+            self.load_blob, [self.enc_row_of[node_id] for node_id in node_ids],
+            self.ciphertext_cache)
         self.node_info = []
         self.text_info = []
         self.extra_info = []
+        # computed once here, retrieval only gathers them by row
+        self.participant_info = []
+        self.snippet_info = []
+        self.centroid_info = np.empty(n_rows, dtype=np.int64)
 
-        for node_id, embedding in self.base_index.vector_store.data.embedding_dict.items():
-            node = self.base_index.docstore.get_node(node_id)
-            encrypted_embedding = self.enc_embeds_store[node_id]
+        for row, node_id in enumerate(node_ids):
+            node = self.docstore.get_node(node_id)
 
-            self.unencrypted_embedding_matrix.append(embedding)
-            self.encrypted_embedding_matrix.append(encrypted_embedding)
             self.node_info.append(node)
             self.text_info.append(node.text)
             self.extra_info.append(node.extra_info)
-        self.encrypted_embedding_matrix = np.array(
-            self.encrypted_embedding_matrix)
-        self.unencrypted_embedding_matrix = np.array(
-            self.unencrypted_embedding_matrix)
+            participant = participant_id(node.metadata['file_path'])
+            self.participant_info.append(participant)
+            self.snippet_info.append(prompt_snippet(participant, node.text))
+            self.centroid_info[row] = self.centroid_assignments.get(node_id, -1)
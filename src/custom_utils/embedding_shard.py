@@ -0,0 +1,34 @@
+import os
+import json
+import numpy as np
+
+# raw (chunks x dim) float32 matrix + the node id of every row, next to the
+# llama_index files of a participant's vector_index
+SHARD_FILENAME = "embeddings.npy"
+NODE_IDS_FILENAME = "node_ids.json"
+
+
+def has_embedding_shard(index_dir):
+    return (os.path.exists(os.path.join(index_dir, SHARD_FILENAME))
+            and os.path.exists(os.path.join(index_dir, NODE_IDS_FILENAME)))
+
+
+def write_embedding_shard(index_dir, node_ids, embeddings, dtype=np.float32):
+    matrix = np.asarray(embeddings, dtype=dtype).reshape(len(node_ids), -1)
+    np.save(os.path.join(index_dir, SHARD_FILENAME), matrix)
+    with open(os.path.join(index_dir, NODE_IDS_FILENAME), "w") as f:
+        json.dump(list(node_ids), f)
+
+
+def load_embedding_shard(index_dir):
+    """
+    (node ids, matrix) of a shard, the matrix is memory mapped read only so
+    opening is near instant and processes share the pages through the page cache.
+    """
+    with open(os.path.join(index_dir, NODE_IDS_FILENAME), "r") as f:
+        node_ids = json.load(f)
+    matrix = np.load(os.path.join(index_dir, SHARD_FILENAME), mmap_mode="r")
+    if len(matrix) != len(node_ids):
+        raise ValueError(f"Embedding shard of {index_dir} has {len(matrix)} rows "
+                         f"for {len(node_ids)} node ids")
+    return node_ids, matrix
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from ast import literal_eval
+from pathlib import Path
+
+# File layout (little endian):
+#   magic        8 bytes   b"FRAGENC\x00"
+#   header       u16 version | u16 flags | u32 n_keys | u32 n_blobs | u32 meta_len
+#   meta         meta_len bytes of utf-8 json (free form, e.g. layout info)
+#   key table    n_keys x (u16 key_len | key bytes)
+#   blob table   n_blobs x (u64 offset | u64 length), offsets from start of file
+#   blobs        serialized CKKS vectors, back to back
+MAGIC = b"FRAGENC\x00"
+VERSION = 1
+HEADER = struct.Struct("<HHIII")
+KEY_LEN = struct.Struct("<H")
+BLOB_ENTRY = struct.Struct("<QQ")
+
+LEGACY_FILENAME = "encrypted__vector_store.json"
+DEFAULT_FILENAME = "encrypted__vector_store.bin"
+CENTROIDS_FILENAME = "encrypted_centroids.bin"
+
+
+def write_encrypted_store(path, keys, blobs, meta=None):
+    """
+    write keys (node ids) + serialized ciphertext blobs to the binary container.
+    for the row layout blob i belongs to keys[i].
+    """
+    keys = [str(key).encode("utf-8") for key in keys]
+    meta = json.dumps(meta or {}).encode("utf-8")
+
+    key_table = b"".join(KEY_LEN.pack(len(key)) + key for key in keys)
+    data_start = (len(MAGIC) + HEADER.size + len(meta) + len(key_table)
+                  + BLOB_ENTRY.size * len(blobs))
+    blob_table = []
+    offset = data_start
+    for blob in blobs:
+        blob_table.append(BLOB_ENTRY.pack(offset, len(blob)))
+        offset += len(blob)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(VERSION, 0, len(keys), len(blobs), len(meta)))
+        f.write(meta)
+        f.write(key_table)
+        f.write(b"".join(blob_table))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def write_encrypted_embeddings(path, encrypted_embeddings: dict, meta=None):
+    # node_id -> serialized ckks vector
+    meta = dict(meta or {}, layout="row")
+    write_encrypted_store(path, list(encrypted_embeddings.keys()),
+                          list(encrypted_embeddings.values()), meta=meta)
+
+
+class EncryptedEmbeddingStore:
+    """
+    Read only, memory mapped view over a binary encrypted embedding file.
+    Only the header and tables are parsed on open, blobs are sliced out of
+    the mapping on access.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._parse()
+
+    def _parse(self):
+        buf = self._mmap
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not an encrypted embedding store")
+        pos = len(MAGIC)
+        version, self.flags, n_keys, n_blobs, meta_len = HEADER.unpack_from(
+            buf, pos)
+        if version != VERSION:
+            raise ValueError(
+                f"Unsupported encrypted store version {version} in {self.path}")
+        pos += HEADER.size
+        self.meta = json.loads(bytes(buf[pos:pos + meta_len]) or b"{}")
+        pos += meta_len
+
+        self.keys = []
+        for _ in range(n_keys):
+            (key_len,) = KEY_LEN.unpack_from(buf, pos)
+            pos += KEY_LEN.size
+            self.keys.append(bytes(buf[pos:pos + key_len]).decode("utf-8"))
+            pos += key_len
+        self.key_to_row = {key: row for row, key in enumerate(self.keys)}
+
+        self.blob_table = [BLOB_ENTRY.unpack_from(buf, pos + i * BLOB_ENTRY.size)
+                           for i in range(n_blobs)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_to_row
+
+    def blob(self, i):
+        offset, length = self.blob_table[i]
+        return self._mmap[offset:offset + length]
+
+    def get(self, key):
+        # serialized ciphertext for a node id (row layout)
+        return self.blob(self.key_to_row[key])
+
+    def items(self):
+        for key in self.keys:
+            yield key, self.get(key)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_legacy_encrypted_embeddings(file_path):
+    # old format : {"embedding_dict": str({node_id: bytes})}
+    with open(file_path, 'r') as f:
+        loaded_data = json.load(f)
+    return literal_eval(loaded_data["embedding_dict"])
+
+
+def convert_json_store(json_path, out_path=None):
+    json_path = Path(json_path)
+    if out_path is None:
+        out_path = json_path.with_name(DEFAULT_FILENAME)
+    encrypted_embeddings = read_legacy_encrypted_embeddings(json_path)
+    write_encrypted_embeddings(out_path, encrypted_embeddings)
+    print(f"Converted {json_path} ({os.path.getsize(json_path)} bytes) -> "
+          f"{out_path} ({os.path.getsize(out_path)} bytes)")
+    return out_path
+
+
+def convert_tree(root, remove_legacy=False):
+    # migrate every legacy json store found under root
+    converted = []
+    for json_path in Path(root).rglob(LEGACY_FILENAME):
+        converted.append(convert_json_store(json_path))
+        if remove_legacy:
+            os.remove(json_path)
+    return converted
+
+
+if __name__ == "__main__":
+    # python -m src.custom_utils.encrypted_store <folder> [<folder> ...] [--remove-legacy]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for root in args or ["."]:
+        convert_tree(root, remove_legacy="--remove-legacy" in sys.argv)
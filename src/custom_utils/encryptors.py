@@ -4,12 +4,25 @@ import base64
 import numpy as np
 import tenseal as ts
 
+from src.custom_utils.encrypted_store import (write_encrypted_embeddings,
+                                              EncryptedEmbeddingStore,
+                                              CENTROIDS_FILENAME)
+from src.custom_utils.ann_index import kmeans
+
+
+CKKS_PARAMS = {
+    "poly_modulus_degree": 8192,
+    "coeff_mod_bit_sizes": [60, 40, 40, 60],
+    "global_scale": 2**40
+}
+
 
 def create_context():   # TenSEAL Context for key generation
-    context = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=8192,
-                         coeff_mod_bit_sizes=[60, 40, 40, 60])
+    context = ts.context(ts.SCHEME_TYPE.CKKS,
+                         poly_modulus_degree=CKKS_PARAMS["poly_modulus_degree"],
+                         coeff_mod_bit_sizes=CKKS_PARAMS["coeff_mod_bit_sizes"])
     context.generate_galois_keys()
-    context.global_scale = 2**40
+    context.global_scale = CKKS_PARAMS["global_scale"]
     return context
 
 
@@ -26,6 +39,34 @@ def encrypted_dot_product(query_vector, key_matrix):   # Function/Computation
     return np.array(alignment_score)
 
 
+def slot_count(context):
+    # number of CKKS slots per ciphertext (poly_modulus_degree / 2)
+    parms = context.data.seal_context().first_context_data().parms()
+    return parms.poly_modulus_degree() // 2
+
+
+def packed_block_rows(context, dim):
+    # rows scored per vector x matrix product, the rotations of the replicated
+    # query need dim - 1 free slots after the scores
+    return slot_count(context) - dim + 1
+
+
+def packed_dot_product(query_vector, matrix, context):
+    """
+    Scores for every row of a plaintext (N, dim) matrix against an encrypted query.
+    Rows are taken in blocks of packed_block_rows, each block is one ciphertext x
+    plaintext vector-matrix product (galois rotations) and one decryption.
+    """
+    block_rows = packed_block_rows(context, matrix.shape[1])
+    alignment_score = []
+    for start in range(0, len(matrix), block_rows):
+        # columns of the block, converted per call (no packed copy is kept)
+        block = np.asarray(matrix[start:start + block_rows], dtype=float).T
+        encrypted_result = query_vector.mm(block)
+        alignment_score.extend(encrypted_result.decrypt())   # Decryption
+    return np.array(alignment_score)
+
+
 def read_embeddings(input_file: str):
     with open(input_file, 'r') as file:
         data = json.load(file)
@@ -46,15 +87,25 @@ def read_encrypted_embeddings(file_path: str):
 
 def encrypt_and_store_embeddings(input_folder: str,
                                  embedding_filename="default__vector_store.json",
-                                 output_filename="encrypted__vector_store.json",
-                                 context=None):
+                                 output_filename="encrypted__vector_store.bin",
+                                 context=None,
+                                 reuse_path=None,
+                                 reuse_ids=()):
+    # reuse_path / reuse_ids : previous encrypted store and the node ids whose
+    # ciphertexts can be copied over as is instead of re-encrypting
     if context is None:
         print("No context provided, making new")
         return
     embeddings = read_embeddings(
         input_folder / embedding_filename)["embedding_dict"]
+    reuse_store = None
+    if reuse_path is not None and reuse_ids and os.path.exists(reuse_path):
+        reuse_store = EncryptedEmbeddingStore(reuse_path)
     encrypted_embeddings = {}
     for key, value in embeddings.items():
+        if reuse_store is not None and key in reuse_ids and key in reuse_store:
+            encrypted_embeddings[key] = reuse_store.get(key)
+            continue
         if isinstance(value, list):
             value = np.array(value, dtype=float)
         else:
@@ -65,11 +116,43 @@ def encrypt_and_store_embeddings(input_folder: str,
 
     out_path = os.path.join(input_folder, output_filename)
 
-    with open(out_path, 'w') as f:
-        json.dump({"embedding_dict": str(encrypted_embeddings)}, f)
+    write_encrypted_embeddings(out_path, encrypted_embeddings)
+    if reuse_store is not None:
+        reuse_store.close()
 
     print(f"Encrypted embeddings have been saved to {out_path}")
 
 
+def encrypt_and_store_centroids(input_folder: str,
+                                embedding_filename="default__vector_store.json",
+                                output_filename=CENTROIDS_FILENAME,
+                                context=None,
+                                n_clusters=None):
+    """
+    Coarse stage of two stage encrypted retrieval : k-means centroids of one
+    participant's chunk embeddings (sqrt(chunks) clusters by default), stored
+    encrypted like the chunks, with the node id -> cluster assignment in the meta.
+    """
+    if context is None:
+        print("No context provided, making new")
+        return
+    embeddings = read_embeddings(
+        input_folder / embedding_filename)["embedding_dict"]
+    if not embeddings:
+        return
+    node_ids = list(embeddings.keys())
+    matrix = np.array([embeddings[node_id] for node_id in node_ids], dtype=float)
+    n_clusters = n_clusters or max(1, int(round(np.sqrt(len(node_ids)))))
+    centroids, assignments = kmeans(matrix, n_clusters)
+    encrypted_centroids = {f"centroid_{c}": ts.ckks_vector(context, centroid).serialize()
+                           for c, centroid in enumerate(centroids)}
+
+    out_path = os.path.join(input_folder, output_filename)
+    write_encrypted_embeddings(out_path, encrypted_centroids, meta={
+        "assignments": {node_id: f"centroid_{c}"
+                        for node_id, c in zip(node_ids, assignments.tolist())}})
+    print(f"Encrypted {len(centroids)} centroids have been saved to {out_path}")
+
+
 def decrypt_embeddings(x):
     return x
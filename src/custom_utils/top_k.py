@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def select_top_k(scores, k, min_score=None, groups=None, max_per_group=None):
+    """
+    Positions of the k best scores, sorted by decreasing score.
+    -inf scores (tombstoned / not scored) and scores below min_score are never
+    returned, so fewer than k positions may come back.
+    groups : group id per score (participant), at most max_per_group positions
+    are returned per group.
+    argpartition + sort of the selected positions : O(N + k log k). With a group
+    limit the window is widened (x4) only while the limit dropped candidates.
+    """
+    scores = np.asarray(scores)
+    valid = scores > -np.inf
+    if min_score is not None:
+        valid &= scores >= min_score
+    n_valid = int(valid.sum())
+    k = min(k, n_valid)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n_valid < len(scores):
+        positions = np.flatnonzero(valid)
+        valid_scores = scores[positions]
+    else:
+        positions, valid_scores = None, scores
+
+    window = k
+    while True:
+        window = min(window, n_valid)
+        if window < n_valid:
+            top = np.argpartition(valid_scores, -window)[-window:]
+        else:
+            top = np.arange(n_valid)
+        top = top[np.argsort(-valid_scores[top], kind="stable")]
+        if positions is not None:
+            top = positions[top]
+        if groups is None or max_per_group is None:
+            return top[:k]
+
+        # rank of every position within its group, keep the first max_per_group
+        top_groups = np.asarray(groups)[top]
+        order = np.argsort(top_groups, kind="stable")
+        sorted_groups = top_groups[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        ranks = np.empty(len(top), dtype=np.int64)
+        ranks[order] = np.arange(len(top)) - np.repeat(group_starts,
+                                                       np.diff(np.r_[group_starts, len(top)]))
+        selected = top[ranks < max_per_group]
+        if len(selected) >= k or window == n_valid:
+            return selected[:k]
+        window *= 4
@@ -1,13 +1,17 @@
 import os
-import requests
 import json
 import markdown
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from src.data_utils.http_client import HttpClient, DiskHttpCache
+
 load_dotenv()
 # add github token for increased rate limit
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_RAW_URL = "https://raw.githubusercontent.com"
 
 
 def md_to_text(md: str) -> str:
@@ -19,20 +23,47 @@ def md_to_text(md: str) -> str:
     return soup.get_text()
 
 
-def get_github_user_info(profile_url, word_limit=100):
+def fetch_readme(http, username, repo, raw_url, use_default_branch):
+    """
+    README.md of one repo, from its default branch when requested and known,
+    otherwise by trying main then master.
+    """
+    branches = ['main', 'master']
+    if use_default_branch and repo.get('default_branch'):
+        branches = [repo['default_branch']]
+    for branch in branches:
+        readme_url = f"{raw_url}/{username}/{repo['name']}/{branch}/README.md"
+        readme_response = http.get(readme_url)
+        if readme_response.status_code == 200:
+            return readme_response.text
+    return None
+
+
+def get_github_user_info(profile_url, word_limit=100, http=None,
+                         max_concurrency=8, use_default_branch=False,
+                         api_url=GITHUB_API_URL, raw_url=GITHUB_RAW_URL):
     """
     given a github profile URL, fetch user details + user readme and save to '../github_data/username.txt'
+    http : optional HttpClient, defaults to one backed by the on-disk http cache so
+           unchanged pages are revalidated (ETag / If-None-Match) instead of re-downloaded
+    max_concurrency : number of README fetches in flight at once
+    use_default_branch : read README from the repo's default_branch instead of guessing main/master
     """
+    if http is None:
+        with HttpClient(max_per_host=max_concurrency, cache=DiskHttpCache()) as http:
+            return get_github_user_info(profile_url, word_limit, http, max_concurrency,
+                                        use_default_branch, api_url, raw_url)
+
     username = profile_url.rstrip('/').split('/')[-1]
 
-    user_api_url = f"https://api.github.com/users/{username}"
-    repos_api_url = f"https://api.github.com/users/{username}/repos"
+    user_api_url = f"{api_url}/users/{username}"
+    repos_api_url = f"{api_url}/users/{username}/repos"
 
     headers = {}
     if GITHUB_TOKEN:
         headers["Authorization"] = f"token {GITHUB_TOKEN}"
 
-    user_response = requests.get(user_api_url, headers=headers)
+    user_response = http.get(user_api_url, headers=headers)
     if user_response.status_code != 200:
         print(
             f"Error fetching user info: {user_response.json().get('message', 'Unknown error')}")
@@ -44,11 +75,11 @@ def get_github_user_info(profile_url, word_limit=100):
     all_repos = []
     page = 1
     while True:
-        response = requests.get(repos_api_url, headers=headers, params={
-                                "page": page, "per_page": 100})
-        if user_response.status_code != 200:
+        response = http.get(repos_api_url, headers=headers, params={
+                            "page": page, "per_page": 100})
+        if response.status_code != 200:
             print(
-                f"Error fetching user info: {user_response.json().get('message', 'Unknown error')}")
+                f"Error fetching repos: {response.json().get('message', 'Unknown error')}")
             return
         repos = response.json()
         if not repos:
@@ -57,30 +88,26 @@ def get_github_user_info(profile_url, word_limit=100):
         all_repos.extend(repos)
         page += 1
 
-    readme_response = None
+    # check for usr readme in all repos, max_concurrency fetches at a time
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        readmes = list(executor.map(
+            lambda repo: fetch_readme(http, username, repo, raw_url, use_default_branch),
+            all_repos))
 
-    # check for usr readme in main/master branches of all repos
     available_repos_data = []
     person_info = []
-    for repo in all_repos:
-
-        branches = ['main', 'master']
-        readme_found = False
-        for branch in branches:
-            readme_url = f"https://raw.githubusercontent.com/{username}/{repo['name']}/{branch}/README.md"
-            readme_response = requests.get(readme_url)
-            if readme_response.status_code != 200:
-                continue
-
-            if repo.get('name').lower() == username.lower():
-                person_info.append(readme_response.text)
-            else:
-                readme_response = " ".join(
-                    readme_response.text.split(" ")[:word_limit])
-                readme_response = f"Repo name:{repo}\nRepo description{readme_response}"
-                available_repos_data.append(readme_response)
-
-    if readme_response is not None:
+    for repo, readme in zip(all_repos, readmes):
+        if readme is None:
+            continue
+
+        if repo.get('name').lower() == username.lower():
+            person_info.append(readme)
+        else:
+            readme = " ".join(readme.split(" ")[:word_limit])
+            readme = f"Repo name:{repo}\nRepo description{readme}"
+            available_repos_data.append(readme)
+
+    if all_repos:
         person_info = md_to_text("\n".join(person_info))
         available_repos_data = md_to_text("\n".join(available_repos_data))
         return "Information about person : " + person_info + "\n" + "His projects" + available_repos_data
@@ -2,12 +2,13 @@ import requests
 from bs4 import BeautifulSoup
 
 
-def google_scholar_extractor_util(profile_url):
+def google_scholar_extractor_util(profile_url, http=None):
+    http = http or requests
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.5672.126 Safari/537.36"
     }
     extracted_info = {}
-    response = requests.get(profile_url, headers=headers)
+    response = http.get(profile_url, headers=headers)
     if response.status_code == 200:
         soup = BeautifulSoup(response.text, "html.parser")
         extracted_info["name"] = soup.select_one("#gsc_prf_in").text
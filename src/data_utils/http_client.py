@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class CachedResponse:
+    """
+    Minimal stand-in for requests.Response, served from the disk cache
+    after a 304 Not Modified revalidation.
+    """
+
+    def __init__(self, url, entry):
+        self.url = url
+        self.status_code = entry["status_code"]
+        self.text = entry["text"]
+        self.headers = entry["headers"]
+        self.from_cache = True
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class DiskHttpCache:
+    """
+    On disk cache of GET responses keyed by full url.
+    Only responses carrying an ETag or Last-Modified header are stored,
+    they are revalidated with If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, cache_dir=Path(os.path.expanduser("~")) / ".federated_rag" / "http_cache"):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url):
+        return self.cache_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def load(self, url):
+        path = self._path(url)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def store(self, url, response):
+        # response.headers is case insensitive, store canonical names only
+        headers = {key: response.headers[key]
+                   for key in ("ETag", "Last-Modified", "Content-Type")
+                   if key in response.headers}
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return
+        entry = {"status_code": response.status_code,
+                 "text": response.text, "headers": headers}
+        tmp_path = self._path(url).with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(url))
+
+    def validators(self, entry):
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+
+class HttpClient:
+    """
+    Thread safe wrapper around one pooled requests.Session.
+    Connections are kept alive and reused across scrapers, every request gets
+    a timeout and at most `max_per_host` requests run against a host at once.
+    """
+
+    def __init__(self, max_per_host=4, pool_size=32, timeout=(5, 30),
+                 retries=2, headers=None, cache=None):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        # optional DiskHttpCache, GETs are then revalidated instead of re-downloaded
+        self.cache = cache
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries, backoff_factor=0.5,
+                                                status_forcelist=[502, 503, 504]))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, host):
+        # also usable around clients that do their own http (e.g. linkedin_api)
+        with self._lock:
+            slot = self._host_slots.setdefault(
+                host, threading.BoundedSemaphore(self.max_per_host))
+        with slot:
+            yield
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if self.cache is None:
+            with self.host_slot(urlparse(url).netloc):
+                return self.session.get(url, **kwargs)
+
+        cache_key = requests.Request("GET", url, params=kwargs.get("params")).prepare().url
+        entry = self.cache.load(cache_key)
+        if entry is not None:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}),
+                                 **self.cache.validators(entry)}
+        with self.host_slot(urlparse(url).netloc):
+            response = self.session.get(url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            return CachedResponse(cache_key, entry)
+        if response.status_code == 200:
+            self.cache.store(cache_key, response)
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
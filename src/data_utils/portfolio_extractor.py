@@ -2,8 +2,9 @@ import requests
 from bs4 import BeautifulSoup
 
 
-def extract_portfolio_data(url):
-    response = requests.get(url)
+def extract_portfolio_data(url, http=None):
+    http = http or requests
+    response = http.get(url)
 
     if response.status_code == 200:
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -0,0 +1,121 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from src.data_utils.http_client import HttpClient, DiskHttpCache
+from src.data_utils.linkedin_extractor import LinkedinScraper
+from src.data_utils.resume_extractor import pdf_to_text
+from src.data_utils.github_extractor import get_github_user_info
+from src.data_utils.google_scholar_extractor import google_scholar_extractor_util
+from src.data_utils.portfolio_extractor import extract_portfolio_data
+from src.utils import remove_emails_and_phone_numbers
+
+
+@dataclass(frozen=True)
+class ScrapeSource:
+    name: str
+    link_key: str       # key in the dict returned by get_links_from_config
+    header: str         # section header written to bio.txt
+    fetch: Callable     # fetch(link, http) -> text
+
+
+def fetch_linkedin(link, http):
+    linkedin_scraper = LinkedinScraper(user_email='', pwd='')
+    profile_username = linkedin_scraper.get_profile_usr(link)
+    # linkedin_api keeps its own session, only share the per host limit
+    with http.host_slot("www.linkedin.com"):
+        profile_data = linkedin_scraper.scrape_profile(profile_username)
+    return remove_emails_and_phone_numbers(str(profile_data))
+
+
+def fetch_github(link, http):
+    return remove_emails_and_phone_numbers(get_github_user_info(link, http=http))
+
+
+def fetch_google_scholar(link, http):
+    return str(google_scholar_extractor_util(link, http=http))
+
+
+def fetch_portfolio(link, http):
+    return extract_portfolio_data(link, http=http)
+
+
+def fetch_resume(link, http):
+    return remove_emails_and_phone_numbers(pdf_to_text(link))
+
+
+LINKEDIN = ScrapeSource("linkedin", "linkedin", "# Linkedin Information:\n", fetch_linkedin)
+GITHUB = ScrapeSource("github", "github", "# Github Information:\n", fetch_github)
+GOOGLE_SCHOLAR = ScrapeSource("google_scholar", "google_scholar", "# google_scholar: \n",
+                              fetch_google_scholar)
+PORTFOLIO = ScrapeSource("portfolio", "misc", "# portfolio: \n", fetch_portfolio)
+RESUME = ScrapeSource("resume", "resume_path", "# Resume: \n", fetch_resume)
+
+
+def _run_source(participant, source, link, http):
+    try:
+        return source.fetch(link, http)
+    except Exception as e:
+        print(f"{source.name} scraping failed for {participant}: {e}")
+        return None
+
+
+def scrape_participants(participants: list[str], datasite_path: Path,
+                        get_links: Callable, sources: list[ScrapeSource],
+                        max_workers=8, http=None, force_participants=()):
+    """
+    Scrape every (participant, source) pair concurrently on a bounded thread pool
+    and write public/bio.txt for participants that do not have one yet.
+    force_participants : scraped again and their bio rewritten even if it exists
+    (their config.json links changed).
+    Sections keep the order of `sources` in the written bio.
+    Returns (active participants, inactive participants, sources found per participant).
+    """
+    own_http = http is None
+    http = http or HttpClient(cache=DiskHttpCache())
+
+    jobs = {}
+    for participant in participants:
+        participant_path = Path(datasite_path)/participant/"public"
+        participant_path.mkdir(parents=True, exist_ok=True)
+        if (participant_path/"bio.txt").exists() and participant not in force_participants:
+            print(
+                f"Skipping data extraction for {participant}: bio already exists")
+            continue
+        links = get_links(participant_path / "config.json")
+        jobs[participant] = [(source, links.get(source.link_key))
+                             for source in sources if links.get(source.link_key)]
+
+    active_participants = []
+    inactive_participants = []
+    sources_found = defaultdict(list)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {participant: [(source, executor.submit(_run_source, participant,
+                                                              source, link, http))
+                                     for source, link in participant_jobs]
+                       for participant, participant_jobs in jobs.items()}
+
+            for participant, participant_futures in futures.items():
+                extracted_info = []
+                for source, future in participant_futures:
+                    text = future.result()
+                    if text:
+                        extracted_info.append(source.header)
+                        extracted_info.append(text)
+                        sources_found[participant].append(source.name)
+
+                if len(extracted_info) > 0:
+                    bio_path = Path(datasite_path)/participant/"public"/"bio.txt"
+                    with open(bio_path, 'w', encoding='utf-8') as bio_file:
+                        bio_file.writelines(extracted_info)
+                    active_participants.append(participant)
+                else:
+                    inactive_participants.append(participant)
+    finally:
+        if own_http:
+            http.close()
+
+    return active_participants, inactive_participants, sources_found
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path(os.path.expanduser("~")) / ".federated_rag" / "embedding_cache.sqlite"
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk embedding cache for ingestion, keyed on (chunk text sha256,
+    embed model). Survives rebuilds and forced reindexes and is shared across
+    participants and index worker processes (sqlite in WAL mode).
+    Embeddings are stored as raw float32 bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                          "text_hash TEXT NOT NULL, model TEXT NOT NULL, "
+                          "embedding BLOB NOT NULL, PRIMARY KEY (text_hash, model))")
+        self.conn.commit()
+
+    def get_many(self, text_hashes, model):
+        # text hash -> embedding (list of floats) for the hashes found
+        found = {}
+        unique_hashes = list(set(text_hashes))
+        with self._lock:
+            # sqlite limits the number of bound parameters per statement
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                rows = self.conn.execute(
+                    "SELECT text_hash, embedding FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch]).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items, model):
+        # items : iterable of (text hash, embedding)
+        rows = [(text_hash, model, np.asarray(embedding, dtype=np.float32).tobytes())
+                for text_hash, embedding in items]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (text_hash, model, embedding) "
+                "VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
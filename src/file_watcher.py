@@ -0,0 +1,184 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+# files of a participant that trigger a scrape / reindex : datasites/<participant>/public/<name>
+WATCHED_FILENAMES = ("bio.txt", "config.json")
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+FILE_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ATTRIB
+DIR_EVENTS = IN_CREATE | IN_MOVED_TO
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """
+    Fallback watcher : stats the watched files of every participant each
+    poll_interval seconds and reports the participants whose files changed.
+    """
+
+    def __init__(self, datasite_path, poll_interval=2.0):
+        self.datasite_path = Path(datasite_path)
+        self.poll_interval = poll_interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for participant_dir in self.datasite_path.iterdir():
+            if not participant_dir.is_dir():
+                continue
+            for name in WATCHED_FILENAMES:
+                try:
+                    stat = (participant_dir / "public" / name).stat()
+                    snapshot[(participant_dir.name, name)] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    pass
+        return snapshot
+
+    def wait(self, timeout=None):
+        # set of changed participants, empty when nothing changed within timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {participant for (participant, _), _ in
+                       set(snapshot.items()) ^ set(self.snapshot.items())}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            sleep_for = self.poll_interval if deadline is None else \
+                min(self.poll_interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(sleep_for)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Linux inotify (through ctypes) on the datasites folder, every participant
+    folder and every participant public folder. Blocks in select() while idle.
+    """
+
+    def __init__(self, datasite_path):
+        self.datasite_path = Path(datasite_path)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> (participant or None for the root, is public folder)
+        self.watches = {}
+        self._add_watch(self.datasite_path, None, False)
+        for participant_dir in self.datasite_path.iterdir():
+            if participant_dir.is_dir():
+                self._watch_participant(participant_dir.name)
+
+    def _add_watch(self, path, participant, is_public):
+        mask = (FILE_EVENTS | DIR_EVENTS) if is_public else DIR_EVENTS
+        wd = self.libc.inotify_add_watch(self.fd, str(path).encode(), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.watches[wd] = (participant, is_public)
+
+    def _watch_participant(self, participant):
+        participant_dir = self.datasite_path / participant
+        try:
+            self._add_watch(participant_dir, participant, False)
+            if (participant_dir / "public").is_dir():
+                self._add_watch(participant_dir / "public", participant, True)
+        except OSError as e:
+            print(f"Could not watch {participant_dir}: {e}")
+
+    def _read_events(self):
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return changed
+                raise
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, name_len = EVENT_HEADER.unpack_from(buf, pos)
+                name = buf[pos + EVENT_HEADER.size:
+                           pos + EVENT_HEADER.size + name_len].rstrip(b"\0").decode()
+                pos += EVENT_HEADER.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    # events were dropped, consider everyone changed
+                    changed.update(p.name for p in self.datasite_path.iterdir() if p.is_dir())
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                participant, is_public = self.watches.get(wd, (None, False))
+                if participant is None:
+                    if mask & IN_ISDIR:
+                        # new participant
+                        self._watch_participant(name)
+                        changed.add(name)
+                elif not is_public:
+                    if name == "public" and mask & IN_ISDIR:
+                        self._add_watch(self.datasite_path / participant / "public",
+                                        participant, True)
+                        changed.add(participant)
+                elif name in WATCHED_FILENAMES:
+                    changed.add(participant)
+
+    def wait(self, timeout=None):
+        # set of changed participants, empty when nothing changed within timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed = self._read_events()
+                if changed:
+                    return changed
+            elif deadline is not None:
+                return set()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(datasite_path, poll_interval=2.0):
+    # inotify when available (linux), stat polling otherwise
+    try:
+        return InotifyWatcher(datasite_path)
+    except (OSError, AttributeError, TypeError) as e:
+        print(f"inotify unavailable ({e}), polling every {poll_interval}s")
+        return PollingWatcher(datasite_path, poll_interval)
+
+
+def debounced_changes(watcher, debounce=2.0):
+    """
+    Blocks until something changes, then keeps collecting until no event arrived
+    for `debounce` seconds, so a burst of writes gives one batch of participants.
+    """
+    changed = set(watcher.wait())
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed
+        changed |= more
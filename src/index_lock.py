@@ -0,0 +1,28 @@
+import os
+import fcntl
+import hashlib
+from pathlib import Path
+from contextlib import contextmanager
+
+# kept outside the synced datasite folders
+DEFAULT_LOCK_DIR = Path(os.path.expanduser("~")) / ".federated_rag" / "locks"
+
+
+@contextmanager
+def index_lock(index_dir, kind="build", shared=False, lock_dir=DEFAULT_LOCK_DIR):
+    """
+    flock on a participant's vector_index folder, across processes (app, main,
+    index updater daemon).
+    kind "build" : held exclusive for a whole index_creator run, builds of the same
+                   participant never interleave.
+    kind "swap"  : held exclusive only for the renames of the swap and shared by
+                   readers copying the folder (sync_indices), so a reader never sees
+                   half of a swap without waiting for a whole build.
+    """
+    lock_dir = Path(lock_dir)
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    lock_path = lock_dir / (f"index_{kind}_" + hashlib.sha256(
+        os.path.abspath(index_dir).encode()).hexdigest()[:16] + ".lock")
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+from pathlib import Path
+from collections import Counter
+
+from src.manifest_utils import file_sha256
+from src.index_lock import index_lock
+
+# kept at the root of the target folder, so it is not part of any index folder signature
+SYNC_MANIFEST_FILENAME = ".sync_manifest.json"
+INDEX_PREFIX = "vector_index_"
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def place_file(src, dst, allow_hardlinks=False):
+    """
+    Puts src at dst without rewriting the data when the filesystem allows it :
+    hardlink (only with allow_hardlinks), then reflink (copy on write clone),
+    then a plain copy. Returns the method used. The swap is atomic (temp file + rename).
+    NOTE : a hardlink shares the inode, an in place write to src (e.g. by the SyftBox
+    client) changes dst too, so hardlinks are off unless src is only ever replaced.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        if allow_hardlinks:
+            return "unchanged"
+        # linked by an earlier sync, replaced below by a copy to break the link
+    tmp_path = f"{dst}.sync.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        if not allow_hardlinks:
+            raise OSError("hardlinks disabled")
+        os.link(src, tmp_path)
+        method = "linked"
+    except OSError:
+        try:
+            _reflink(src, tmp_path)
+            shutil.copystat(src, tmp_path)
+            method = "reflinked"
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            shutil.copy2(src, tmp_path)
+            method = "copied"
+    os.replace(tmp_path, dst)
+    if os.path.lexists(tmp_path):
+        # rename() is a no-op when tmp_path and dst are links to the same inode
+        os.remove(tmp_path)
+    return method
+
+
+def sync_tree(src, dst, manifest, allow_hardlinks=False):
+    """
+    Makes dst mirror src, touching only files that changed since the last sync.
+    manifest : relative path -> {"size", "mtime_ns", "sha256"} of the source files
+    at the last sync, updated in place. A file whose size + mtime match is skipped,
+    a file whose mtime changed but hash didn't only gets its manifest entry updated.
+    Returns a Counter of file operations and copied bytes.
+    """
+    src, dst = Path(src), Path(dst)
+    stats = Counter()
+    if not src.is_dir():
+        # never mirror a missing source as an empty index folder
+        raise FileNotFoundError(f"Index source {src} does not exist")
+    seen = set()
+    for src_file in src.rglob("*"):
+        if not src_file.is_file():
+            continue
+        rel_path = src_file.relative_to(src).as_posix()
+        seen.add(rel_path)
+        dst_file = dst / rel_path
+        stat = src_file.stat()
+        entry = manifest.get(rel_path)
+        if entry is not None and dst_file.exists():
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                stats["unchanged"] += 1
+                continue
+            if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(src_file):
+                entry["mtime_ns"] = stat.st_mtime_ns
+                stats["unchanged"] += 1
+                continue
+
+        dst_file.parent.mkdir(parents=True, exist_ok=True)
+        method = place_file(src_file, dst_file, allow_hardlinks)
+        stats[method] += 1
+        if method == "copied":
+            stats["bytes_copied"] += stat.st_size
+        manifest[rel_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                              "sha256": file_sha256(src_file)}
+
+    # files that disappeared from the source
+    for rel_path in [rel_path for rel_path in manifest if rel_path not in seen]:
+        del manifest[rel_path]
+    if dst.exists():
+        for dst_file in list(dst.rglob("*")):
+            if dst_file.is_file() and dst_file.relative_to(dst).as_posix() not in seen:
+                dst_file.unlink()
+                stats["removed"] += 1
+    return stats
+
+
+def load_sync_manifest(target):
+    manifest_path = Path(target) / SYNC_MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        print(f"Ignoring unreadable sync manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_sync_manifest(target, manifest):
+    manifest_path = Path(target) / SYNC_MANIFEST_FILENAME
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def sync_indices(index_paths: dict, target, allow_hardlinks=False):
+    """
+    index_paths : participant -> source vector_index folder.
+    Mirrors every index into target/vector_index_<participant> differentially and
+    removes the index folders of participants that are no longer in index_paths.
+    A participant whose source folder is missing (e.g. mid swap in index_creator)
+    is skipped, its last synced copy is kept as is.
+    """
+    start = time.time()
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    manifest = load_sync_manifest(target)
+    stats = Counter()
+
+    for user, index_path in index_paths.items():
+        folder_name = f"{INDEX_PREFIX}{user}"
+        if not Path(index_path).is_dir():
+            print(f"Index source {index_path} missing, skipping {user} (last synced copy kept)")
+            stats["participants_skipped"] += 1
+            continue
+        # shared lock : index_creator does not swap the folder while it is copied
+        with index_lock(index_path, kind="swap", shared=True):
+            user_stats = sync_tree(index_path, target / folder_name,
+                                   manifest.setdefault(folder_name, {}), allow_hardlinks)
+        stats.update(user_stats)
+
+    active = {f"{INDEX_PREFIX}{user}" for user in index_paths}
+    for folder in target.iterdir():
+        if folder.is_dir() and folder.name.startswith(INDEX_PREFIX) \
+                and folder.name not in active:
+            shutil.rmtree(folder)
+            manifest.pop(folder.name, None)
+            stats["participants_removed"] += 1
+            print(f"Removed index of departed participant {folder.name}")
+
+    save_sync_manifest(target, manifest)
+    print(f"Synced {len(index_paths)} indexes in {time.time() - start:.2f}s : "
+          f"{stats['copied']} copied ({stats['bytes_copied'] / 2**20:.1f} MB), "
+          f"{stats['linked']} hardlinked, {stats['reflinked']} reflinked, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed files, "
+          f"{stats['participants_removed']} departed participants, "
+          f"{stats['participants_skipped']} skipped")
+    return stats
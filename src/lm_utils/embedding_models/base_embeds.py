@@ -1,9 +1,129 @@
+import os
+import sys
+import json
+import atexit
+import threading
+from collections import OrderedDict
+
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core import (
     Settings
 )
 
 
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (model name, normalized query text).
+    Derived per-query artifacts (e.g. the encrypted query vector) can be stored
+    alongside, in an LRU of their own bounded by max_artifact_bytes (serialized
+    size) since ciphertexts are large.
+    Embeddings, not artifacts, are optionally persisted to a json file.
+    """
+
+    def __init__(self, max_size=1024, max_artifact_bytes=64 * 2**20, persist_path=None):
+        self.max_size = max_size
+        self.max_artifact_bytes = max_artifact_bytes
+        self.persist_path = persist_path
+        self.embeddings = OrderedDict()
+        # key -> (value, size in bytes)
+        self.artifacts = OrderedDict()
+        self.artifact_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if persist_path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.lower().split()).rstrip("?!. ")
+
+    def key(self, model_name, text):
+        return f"{model_name}::{self.normalize(text)}"
+
+    def get(self, model_name, text):
+        key = self.key(model_name, text)
+        with self._lock:
+            if key in self.embeddings:
+                self.hits += 1
+                self.embeddings.move_to_end(key)
+                return self.embeddings[key]
+            self.misses += 1
+            return None
+
+    def put(self, model_name, text, embedding):
+        with self._lock:
+            self._put(self.embeddings, self.key(model_name, text),
+                      embedding, self.max_size)
+
+    def get_artifact(self, model_name, text, name):
+        key = (self.key(model_name, text), name)
+        with self._lock:
+            if key in self.artifacts:
+                self.artifacts.move_to_end(key)
+                return self.artifacts[key][0]
+            return None
+
+    @staticmethod
+    def artifact_size(value):
+        # serialized size for ciphertexts (CKKSVector.serialize), recursive for lists
+        if hasattr(value, "serialize"):
+            return len(value.serialize())
+        if isinstance(value, (list, tuple)):
+            return sum(QueryEmbeddingCache.artifact_size(item) for item in value)
+        return sys.getsizeof(value)
+
+    def put_artifact(self, model_name, text, name, value):
+        n_bytes = self.artifact_size(value)
+        if n_bytes > self.max_artifact_bytes:
+            # would evict everything else and still not fit
+            return
+        key = (self.key(model_name, text), name)
+        with self._lock:
+            if key in self.artifacts:
+                self.artifact_bytes -= self.artifacts.pop(key)[1]
+            self.artifacts[key] = (value, n_bytes)
+            self.artifact_bytes += n_bytes
+            while self.artifact_bytes > self.max_artifact_bytes:
+                _, (_, evicted_bytes) = self.artifacts.popitem(last=False)
+                self.artifact_bytes -= evicted_bytes
+
+    @staticmethod
+    def _put(entries, key, value, max_size):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.embeddings),
+                "artifact_bytes": self.artifact_bytes}
+
+    def load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r") as f:
+                for key, embedding in json.load(f).items():
+                    self._put(self.embeddings, key, embedding, self.max_size)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable query embedding cache {self.persist_path}: {e}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+        with self._lock:
+            data = dict(self.embeddings)
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.persist_path)
+
+
 class BaseEmbeddingModel:
     """
     Abstract class for interfacing any Embedding model.
@@ -17,19 +137,79 @@ class BaseEmbeddingModel:
     def embed_data(self, data):
         pass
 
+    def embed_many(self, data_list):
+        return [self.embed_data(data) for data in data_list]
+
+    def cached_artifact(self, data, name, build):
+        # models without a query cache just build the artifact every time
+        return build()
+
 
 class BgeSmallEmbedModel(BaseEmbeddingModel):
     """
     Assuming llama-index-implementation as base class
     and "BAAI/bge-small-en-v1.5" as default embedding model.
+    cache_size : number of query embeddings kept in the LRU cache (0 disables it)
+    cache_path : optional json file the cache is loaded from and saved to at exit
     """
 
-    def __init__(self, model_name="BAAI/bge-small-en-v1.5"):
+    def __init__(self, model_name="BAAI/bge-small-en-v1.5",
+                 cache_size=1024, cache_path=None):
         super().__init__(model_name)
         self.embedding_model = HuggingFaceEmbedding(model_name=self.model_name)
         Settings.embed_model = self.embedding_model
+        self.query_cache = None
+        if cache_size > 0:
+            self.query_cache = QueryEmbeddingCache(max_size=cache_size,
+                                                   persist_path=cache_path)
         print(self.model_name)
 
     def embed_data(self, data):
-        data_embedding = self.embedding_model.get_query_embedding(data)
+        if self.query_cache is None:
+            return self.embedding_model.get_query_embedding(data)
+        data_embedding = self.query_cache.get(self.model_name, data)
+        if data_embedding is None:
+            data_embedding = self.embedding_model.get_query_embedding(data)
+            self.query_cache.put(self.model_name, data, data_embedding)
         return data_embedding
+
+    def embed_many(self, data_list):
+        """
+        embeddings for a batch of queries, only the cache misses go through the model
+        (public get_query_embedding, same query prompt as embed_data).
+        """
+        data_embeddings = [None] * len(data_list)
+        misses = []
+        for i, data in enumerate(data_list):
+            if self.query_cache is not None:
+                data_embeddings[i] = self.query_cache.get(self.model_name, data)
+            if data_embeddings[i] is None:
+                misses.append(i)
+        if not misses:
+            return data_embeddings
+
+        embeddings = [self.embedding_model.get_query_embedding(data_list[i])
+                      for i in misses]
+        for i, embedding in zip(misses, embeddings):
+            data_embeddings[i] = embedding
+            if self.query_cache is not None:
+                self.query_cache.put(self.model_name, data_list[i], embedding)
+        return data_embeddings
+
+    def cached_artifact(self, data, name, build):
+        """
+        value derived from the query `data` (e.g. its encrypted embedding),
+        cached next to the query embedding under `name`.
+        """
+        if self.query_cache is None:
+            return build()
+        value = self.query_cache.get_artifact(self.model_name, data, name)
+        if value is None:
+            value = build()
+            self.query_cache.put_artifact(self.model_name, data, name, value)
+        return value
+
+    def cache_stats(self):
+        if self.query_cache is None:
+            return {}
+        return self.query_cache.stats()
@@ -1,6 +1,7 @@
 import json
 import time
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from threading import Thread
+from transformers import T5Tokenizer, T5ForConditionalGeneration, TextIteratorStreamer
 import google.generativeai as genai
 from llama_index.llms.ollama import Ollama
 
@@ -26,6 +27,14 @@ class BaseLLModel:
     def generate_response(self, *args):
         return ""
 
+    def stream_response(self, context, query):
+        # models without native streaming yield the whole answer as one chunk
+        yield self.generate_response(context, query)
+
+    def cacheable_response(self, response):
+        # answer as stored in the response cache (without per call details)
+        return response
+
     def make_prompt(self, context, query):
         return f"""
               Answer from given context, Be very specific and accurate.
@@ -65,6 +74,20 @@ class T5LLM(BaseLLModel):
         out = self.postprocess(outputs, prompt)
         return out
 
+    def stream_response(self, context, query):
+        prompt = self.make_prompt(context, query)
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids
+        streamer = TextIteratorStreamer(self.tokenizer, skip_special_tokens=True)
+        # generate runs in the background, decoded text is pushed into the streamer
+        thread = Thread(target=self.llm.generate,
+                        kwargs={"input_ids": input_ids,
+                                "max_new_tokens": self.max_new_tokens,
+                                "streamer": streamer})
+        thread.start()
+        for text in streamer:
+            yield text
+        thread.join()
+
 
 class GeminiLLM(BaseLLModel):
     def __init__(self, api_key_path="api_key.json",
@@ -88,8 +111,15 @@ class GeminiLLM(BaseLLModel):
         response = self.llm.generate_content(prompt)
         return response.text
 
+    def stream_response(self, context, query):
+        prompt = self.make_prompt(context, query)
+        for chunk in self.llm.generate_content(prompt, stream=True):
+            yield chunk.text
+
 
 class OllamaLLM(BaseLLModel):
+    TIME_PREFIX = "Time taken for reponse : "
+
     def __init__(self,
                  model_name='qwen2:1.5b', max_tokens=100):
         super().__init__(model_name, None)
@@ -107,4 +137,17 @@ class OllamaLLM(BaseLLModel):
         response = self.llm.complete(prompt)
         end = time.time()
         time_taken = end - start
-        return response.text + f"\n" + f"Time taken for reponse : {time_taken:.2f} seconds"
+        return response.text + "\n" + f"{self.TIME_PREFIX}{time_taken:.2f} seconds"
+
+    def stream_response(self, context, query):
+        prompt = self.make_prompt(context, query)
+        start = time.time()
+        for response in self.llm.stream_complete(prompt):
+            yield response.delta or ""
+        time_taken = time.time() - start
+        yield "\n" + f"{self.TIME_PREFIX}{time_taken:.2f} seconds"
+
+    def cacheable_response(self, response):
+        # drop the trailing timing line, a cache hit would replay a stale timing
+        answer, sep, timing = response.rpartition(f"\n{self.TIME_PREFIX}")
+        return answer if sep and "\n" not in timing else response
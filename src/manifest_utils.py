@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+from collections import Counter
+
+from src.custom_utils.encryptors import CKKS_PARAMS
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_keys(texts):
+    # content hash + occurrence count, so repeated chunks in one bio stay distinct
+    seen = Counter()
+    keys = []
+    for text in texts:
+        text_hash = text_sha256(text)
+        keys.append(f"{text_hash}:{seen[text_hash]}")
+        seen[text_hash] += 1
+    return keys
+
+
+def pipeline_params(node_pipeline):
+    """
+    chunking + embedding params of an IngestionPipeline
+    (SentenceSplitter followed by an embedding model).
+    """
+    params = {"chunk_size": None, "chunk_overlap": None, "embed_model": None}
+    for transformation in node_pipeline.transformations:
+        if hasattr(transformation, "chunk_size"):
+            params["chunk_size"] = transformation.chunk_size
+            params["chunk_overlap"] = transformation.chunk_overlap
+        if hasattr(transformation, "model_name"):
+            params["embed_model"] = transformation.model_name
+    return params
+
+
+def build_manifest(bio_hash, params, chunks: dict, key_id=None):
+    # chunks : chunk key -> node id
+    # key_id : fingerprint of the CKKS keys the stored ciphertexts belong to
+    return {
+        "bio_sha256": bio_hash,
+        "chunk_size": params["chunk_size"],
+        "chunk_overlap": params["chunk_overlap"],
+        "embed_model": params["embed_model"],
+        "ckks": CKKS_PARAMS,
+        "key_id": key_id,
+        "chunks": chunks
+    }
+
+
+def load_manifest(index_dir):
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+
+
+def save_manifest(index_dir, manifest):
+    with open(os.path.join(index_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def same_embedding_params(manifest, params):
+    # stored embeddings can be reused only if chunking + model are unchanged
+    return manifest is not None and all(
+        manifest.get(key) == params[key]
+        for key in ("chunk_size", "chunk_overlap", "embed_model"))
+
+
+def same_encryption_params(manifest, key_id=None):
+    return (manifest is not None
+            and manifest.get("ckks") == CKKS_PARAMS
+            and manifest.get("key_id") == key_id)
+
+
+def is_up_to_date(manifest, bio_hash, params, key_id=None):
+    return (manifest is not None
+            and manifest.get("bio_sha256") == bio_hash
+            and same_embedding_params(manifest, params)
+            and same_encryption_params(manifest, key_id))
@@ -0,0 +1,99 @@
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import threading
+from pathlib import Path
+from collections import Counter
+
+DEFAULT_LOCK_DIR = Path(os.path.expanduser("~")) / ".federated_rag" / "locks"
+
+
+def add_pageviews(fname, count, lock_dir=DEFAULT_LOCK_DIR):
+    """
+    Adds count views to a pageviews.json. Read-modify-write happens under an
+    exclusive file lock (kept outside the synced datasite folders) so several
+    processes can update the same file, the write itself is temp file + rename.
+    """
+    lock_dir = Path(lock_dir)
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    lock_path = lock_dir / (hashlib.sha256(
+        os.path.abspath(fname).encode()).hexdigest()[:16] + ".lock")
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        current_pageviews = {"views": 0}
+        if os.path.exists(fname):
+            try:
+                with open(fname, "r") as f:
+                    content = f.read().strip()
+                if content:
+                    current_pageviews = json.loads(content)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Resetting unreadable page views {fname}: {e}")
+        current_pageviews["views"] = current_pageviews.get("views", 0) + count
+
+        tmp_path = f"{fname}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(current_pageviews, f)
+        os.replace(tmp_path, fname)
+
+
+class PageViewWriter:
+    """
+    Page view increments are counted in memory and written by a background thread
+    every flush_interval seconds (and at exit), one file update per touched
+    pageviews.json per flush instead of one rewrite per hit on the query path.
+    """
+
+    def __init__(self, flush_interval=5.0, lock_dir=DEFAULT_LOCK_DIR):
+        self.flush_interval = flush_interval
+        self.lock_dir = lock_dir
+        self.pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def increment(self, fname, count=1):
+        with self._lock:
+            self.pending[str(fname)] += count
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, Counter()
+            for fname, count in pending.items():
+                try:
+                    add_pageviews(fname, count, self.lock_dir)
+                except OSError as e:
+                    # keep the views for the next flush
+                    print(f"Could not write page views to {fname}: {e}")
+                    self.increment(fname, count)
+            if pending:
+                print(f"Page views written for {len(pending)} files")
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+        self.flush()
+
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def default_pageview_writer():
+    # one writer thread per process, shared by every GraphComposer (rebuilds included)
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = PageViewWriter()
+        return _default_writer
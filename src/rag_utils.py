@@ -1,53 +1,477 @@
 import os
+import json
 import shutil
+import tempfile
+import time
+import hashlib
+import threading
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import tenseal as ts
 
 from llama_index.core import (
     VectorStoreIndex,
     SimpleDirectoryReader,
 )
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
 
 # custom imports
 from src.custom_utils.custom_compose import GraphComposer
 
 # TODO : Parth : Implement this file
-from src.custom_utils.encryptors import encrypt_and_store_embeddings
+from src.custom_utils.encryptors import (encrypt_and_store_embeddings,
+                                         encrypt_and_store_centroids)
+from src.custom_utils.context_store import context_key_id
+from src.custom_utils.embedding_shard import (has_embedding_shard,
+                                              write_embedding_shard,
+                                              load_embedding_shard)
+from src.embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+from src.index_lock import index_lock
+from src.manifest_utils import (file_sha256, text_sha256, chunk_keys, pipeline_params,
+                                build_manifest, load_manifest, save_manifest,
+                                same_embedding_params, same_encryption_params,
+                                is_up_to_date)
+
+ANN_FILENAME = "ann_index.npz"
+# chunking shared by every entry point (app, main, index updater) : the params are
+# part of the manifest, a different value would rebuild every participant
+CHUNK_SIZE = 200
+CHUNK_OVERLAP = 10
+
+
+def make_ingestion_pipeline(embedding_model, chunk_size=CHUNK_SIZE,
+                            chunk_overlap=CHUNK_OVERLAP):
+    return IngestionPipeline(
+        transformations=[SentenceSplitter(chunk_size=chunk_size,
+                                          chunk_overlap=chunk_overlap),
+                         embedding_model])
+MATRIX_FILENAME = "stacked_embeddings.npy"
+
+
+def split_documents(documents, node_pipeline):
+    # run every pipeline step except the embedding model
+    nodes = documents
+    for transformation in node_pipeline.transformations:
+        if not isinstance(transformation, BaseEmbedding):
+            nodes = transformation(nodes)
+    return nodes
+
+
+def embed_nodes(nodes, node_pipeline, embedding_cache=None, batch_size=32):
+    """
+    Embeds nodes in batches of batch_size chunks, chunks found in the embedding
+    cache (same text + same model) are not embedded again.
+    Returns the number of cache hits.
+    """
+    if not nodes:
+        return 0
+    embed_model = [transformation for transformation in node_pipeline.transformations
+                   if isinstance(transformation, BaseEmbedding)][0]
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED)
+             for node in nodes]
+    text_hashes = [text_sha256(text) for text in texts]
+    cached = {}
+    if embedding_cache is not None:
+        cached = embedding_cache.get_many(text_hashes, embed_model.model_name)
+
+    missing = [i for i, text_hash in enumerate(text_hashes) if text_hash not in cached]
+    # the model would otherwise re-split every batch by its own embed_batch_size
+    embed_model.embed_batch_size = batch_size
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        embeddings = embed_model.get_text_embedding_batch([texts[i] for i in batch])
+        for i, embedding in zip(batch, embeddings):
+            cached[text_hashes[i]] = embedding
+        if embedding_cache is not None:
+            embedding_cache.put_many([(text_hashes[i], embedding)
+                                      for i, embedding in zip(batch, embeddings)],
+                                     embed_model.model_name)
+
+    for node, text_hash in zip(nodes, text_hashes):
+        node.embedding = cached[text_hash]
+    return len(nodes) - len(missing)
+
+
+def rename_nodes(nodes, id_map):
+    # give reused chunks their previous node id and keep prev/next links consistent
+    for node in nodes:
+        if node.node_id in id_map:
+            node.id_ = id_map[node.node_id]
+    for node in nodes:
+        for related in node.relationships.values():
+            for info in (related if isinstance(related, list) else [related]):
+                info.node_id = id_map.get(info.node_id, info.node_id)
+
 
+def load_previous_embeddings(index_dir, embedding_filename="default__vector_store.json"):
+    if has_embedding_shard(index_dir):
+        node_ids, matrix = load_embedding_shard(index_dir)
+        return {node_id: matrix[row].tolist() for row, node_id in enumerate(node_ids)}
+    file_path = Path(index_dir) / embedding_filename
+    if not file_path.exists():
+        return {}
+    with open(file_path, "r") as f:
+        return json.load(f).get("embedding_dict", {})
+
+
+def index_creator(file_path: str, target_path: str, context, node_pipeline,
+                  force=False, embedding_cache=None, embed_batch_size=32):
+    """
+    (Re)build the vector index of one participant.
+    Skipped entirely when bio.txt and the indexing params match the manifest,
+    otherwise only new or modified chunks are embedded and encrypted again.
+    embedding_cache : optional EmbeddingCache, consulted before embedding new chunks.
+    Runs under the participant's build index_lock, the app and the index updater
+    daemon may build the same participant concurrently.
+    """
+    index_dir = Path(target_path) / "vector_index"
+    with index_lock(index_dir):
+        return _create_index(file_path, index_dir, context, node_pipeline,
+                             force, embedding_cache, embed_batch_size)
+
+
+def _create_index(file_path, index_dir, context, node_pipeline,
+                  force, embedding_cache, embed_batch_size):
+    old_dir = index_dir.with_name("vector_index.old")
+    if os.path.exists(old_dir) and not os.path.exists(index_dir):
+        # interrupted between the two renames of a previous swap
+        os.replace(old_dir, index_dir)
+    for stale_dir in index_dir.parent.glob("vector_index.tmp*"):
+        # staging folder of a build that crashed
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    params = pipeline_params(node_pipeline)
+    bio_hash = file_sha256(file_path)
+    manifest = load_manifest(index_dir)
+    key_id = context_key_id(context)
+    if not force and is_up_to_date(manifest, bio_hash, params, key_id):
+        print(f"Index up to date for {file_path}, skipping")
+        return None
 
-def index_creator(file_path: str, target_path: str, context, node_pipeline):
-    # if os.path.exists(Path(target_path) / "vector_index"):
-    #     return []
     doc = SimpleDirectoryReader(input_files=[file_path]).load_data()
-    # run the pipeline
-    nodes = node_pipeline.run(documents=doc)
+    nodes = split_documents(doc, node_pipeline)
+    keys = chunk_keys([node.get_content(metadata_mode=MetadataMode.EMBED)
+                       for node in nodes])
+
+    # chunk key -> previous node id, for chunks whose embedding is still valid
+    previous_chunks = {}
+    if not force and same_embedding_params(manifest, params):
+        previous_chunks = manifest.get("chunks", {})
+    previous_embeddings = load_previous_embeddings(index_dir) if previous_chunks else {}
+
+    id_map = {}
+    new_nodes = []
+    for node, key in zip(nodes, keys):
+        previous_id = previous_chunks.get(key)
+        if previous_id in previous_embeddings:
+            id_map[node.node_id] = previous_id
+            node.embedding = previous_embeddings[previous_id]
+        else:
+            new_nodes.append(node)
+    rename_nodes(nodes, id_map)
+    cache_hits = embed_nodes(new_nodes, node_pipeline, embedding_cache, embed_batch_size)
+    print(f"Reusing {len(nodes) - len(new_nodes)} chunks, "
+          f"{len(new_nodes)} new chunks for {file_path}")
+    if new_nodes:
+        print(f"Embedding cache for {file_path}: {cache_hits}/{len(new_nodes)} hits "
+              f"({cache_hits / len(new_nodes):.0%}), embedded {len(new_nodes) - cache_hits}")
     index = VectorStoreIndex(nodes)
 
-    target_path = Path(target_path) / "vector_index"
-    if os.path.exists(target_path):
-        shutil.rmtree(target_path)
+    # build next to the live index and swap at the end
+    staging_dir = Path(tempfile.mkdtemp(prefix="vector_index.tmp.", dir=index_dir.parent))
+    # mkdtemp creates it private, the index folder is public
+    os.chmod(staging_dir, 0o755)
+    try:
+        index.storage_context.persist(persist_dir=staging_dir)
+        write_embedding_shard(staging_dir, [node.node_id for node in nodes],
+                              [node.embedding for node in nodes])
+        print(f"Index created for {file_path}")
+
+        reuse_ids = set(id_map.values()) if same_encryption_params(manifest, key_id) else set()
+        encrypt_and_store_embeddings(input_folder=staging_dir, context=context,
+                                     reuse_path=index_dir / "encrypted__vector_store.bin",
+                                     reuse_ids=reuse_ids)
+        encrypt_and_store_centroids(input_folder=staging_dir, context=context)
+        print("Embeddings encrypted and saved!")
+        save_manifest(staging_dir, build_manifest(
+            bio_hash, params, {key: node.node_id for key, node in zip(keys, nodes)},
+            key_id=key_id))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
 
-    index.storage_context.persist(persist_dir=target_path)
-    print(f"Index created for {file_path}")
-    encrypt_and_store_embeddings(input_folder=target_path, context=context)
-    print("Embeddings encrypted and saved!")
+    # live folder moved aside, staging renamed in, then the old one deleted :
+    # vector_index is only missing between two renames, never while a tree is deleted
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    with index_lock(index_dir, kind="swap"):
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(staging_dir, index_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
     return index
 
 
+# per process state of the index worker pool, filled by _init_index_worker
+_worker_state = {}
+
+
+def _init_index_worker(params, serialized_context, torch_threads,
+                       embedding_cache_path=None, embed_batch_size=32):
+    # every worker loads its own embedding model + TenSEAL context once
+    from src.lm_utils.embedding_models.base_embeds import BgeSmallEmbedModel
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    embed_model = BgeSmallEmbedModel(params["embed_model"])
+    _worker_state["pipeline"] = make_ingestion_pipeline(
+        embed_model.embedding_model, params["chunk_size"], params["chunk_overlap"])
+    _worker_state["context"] = ts.context_from(serialized_context)
+    _worker_state["embedding_cache"] = (EmbeddingCache(embedding_cache_path)
+                                        if embedding_cache_path else None)
+    _worker_state["embed_batch_size"] = embed_batch_size
+
+
+def _run_index_job(user_folder, value_file, target_path, context, node_pipeline,
+                   embedding_cache=None, embed_batch_size=32):
+    try:
+        index_creator(value_file, target_path=target_path,
+                      context=context, node_pipeline=node_pipeline,
+                      embedding_cache=embedding_cache,
+                      embed_batch_size=embed_batch_size)
+        return user_folder, None
+    except Exception as e:
+        return user_folder, f"{type(e).__name__}: {e}"
+
+
+def _index_worker(user_folder, value_file, target_path):
+    return _run_index_job(user_folder, value_file, target_path,
+                          _worker_state["context"], _worker_state["pipeline"],
+                          _worker_state["embedding_cache"],
+                          _worker_state["embed_batch_size"])
+
+
+def run_index_jobs(jobs, context, node_pipeline, workers=1,
+                   embedding_cache_path=DEFAULT_CACHE_PATH, embed_batch_size=32):
+    """
+    jobs : list of (user_folder, bio path, public folder)
+    Runs index_creator for every job, in a spawn process pool when workers > 1.
+    embedding_cache_path : sqlite chunk embedding cache shared by all jobs, None disables it.
+    A failing participant is reported and skipped, the rest of the batch continues.
+    Returns the list of participants indexed successfully.
+
+    NOTE : spawn re-imports the caller's __main__, so only use workers > 1 from
+    entry points whose module level work sits behind `if __name__ == "__main__"`.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        embedding_cache = EmbeddingCache(embedding_cache_path) if embedding_cache_path else None
+        results = [_run_index_job(*job, context, node_pipeline,
+                                  embedding_cache, embed_batch_size) for job in jobs]
+        if embedding_cache is not None:
+            embedding_cache.close()
+    else:
+        # workers only encrypt, the public part of the context is enough
+        serialized_context = context.serialize(save_secret_key=False,
+                                               save_galois_keys=False)
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_index_worker,
+                                 initargs=(pipeline_params(node_pipeline),
+                                           serialized_context,
+                                           torch_threads,
+                                           embedding_cache_path,
+                                           embed_batch_size)) as executor:
+            futures = [executor.submit(_index_worker, *job) for job in jobs]
+            results = [future.result() for future in futures]
+
+    succeeded = []
+    for user_folder, error in results:
+        if error is None:
+            succeeded.append(user_folder)
+        else:
+            print(f"Index creation failed for {user_folder}: {error}")
+    return succeeded
+
+
+def index_folders(source):
+    index_path_list = []
+    for folder_path in Path(source).iterdir():
+        if folder_path.is_dir() and "vector_index_" in folder_path.name:
+            index_path_list.append(folder_path)
+    return index_path_list
+
+
+def folder_signature(folder_path, use_content_hash=False):
+    """
+    fingerprint of a single index folder, built from file names + sizes + mtimes
+    (or from the file contents when use_content_hash is set).
+    """
+    digest = hashlib.sha256()
+    for file_path in sorted(Path(folder_path).rglob("*")):
+        if not file_path.is_file():
+            continue
+        stat = file_path.stat()
+        digest.update(str(file_path.relative_to(folder_path)).encode())
+        if use_content_hash:
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        else:
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def index_signature(source, use_content_hash=False):
+    # folder name -> fingerprint, for every vector_index_* folder in source
+    return {folder_path.name: folder_signature(folder_path, use_content_hash)
+            for folder_path in index_folders(source)}
+
+
 def load_query_engine(source,
                       embed_model,
                       llm,
                       context,
-                      indexes=None):
+                      indexes=None,
+                      ann_backend="auto",
+                      encrypted_mode="auto",
+                      memory_map=True):
     print("Source:", source)
-    index_path_list = []
-    for folder_path in source.iterdir():
-        if folder_path.is_dir() and "vector_index_" in folder_path.name:
-            index_path_list.append(folder_path)
+    index_path_list = index_folders(source)
 
     graph = GraphComposer(
         indexes_folder_paths=index_path_list,
         embedding_model=embed_model,
         llm=llm,
-        context=context
+        context=context,
+        encrypted_mode=encrypted_mode,
+        ann_backend=ann_backend,
+        # next to the index folders, reused until the stacked embeddings change
+        ann_path=os.path.join(source, ANN_FILENAME),
+        # stacked matrix backed by a read only file mapping (page cache) instead of
+        # anonymous memory, processes composing the same source share the pages
+        matrix_path=os.path.join(source, MATRIX_FILENAME) if memory_map else None
     )
     return graph
+
+
+class WarmQueryEngine:
+    """
+    Long lived holder of a GraphComposer.
+    The composed engine is built once and reused across queries, it is only
+    rebuilt when one of the vector_index_* folders in source changes on disk.
+    With hot_reload only the changed folders are loaded into a new composer
+    snapshot, queries already running keep the previous one.
+    sync : optional callable refreshing the folders in source (e.g. sync_indices from
+    the datasites), run from get() at most every sync_interval seconds.
+    """
+
+    def __init__(self, source, embed_model, llm, context,
+                 use_content_hash=False, response_cache=None, ann_backend="auto",
+                 encrypted_mode="auto", hot_reload=True, sync=None, sync_interval=30.0,
+                 memory_map=True):
+        self.source = Path(source)
+        self.hot_reload = hot_reload
+        self.memory_map = memory_map
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self.last_sync = None
+        self.ann_backend = ann_backend
+        self.encrypted_mode = encrypted_mode
+        # optional SemanticResponseCache, scoped to the current index version
+        self.response_cache = response_cache
+        self.embed_model = embed_model
+        self.llm = llm
+        self.context = context
+        self.use_content_hash = use_content_hash
+        self.engine = None
+        self.signature = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        # single digest over all loaded participant indexes
+        if self.signature is None:
+            return None
+        return hashlib.sha256(
+            json.dumps(self.signature, sort_keys=True).encode()).hexdigest()
+
+    def invalidate(self):
+        with self._lock:
+            self.engine = None
+            self.signature = None
+
+    def reload_changed(self, signature):
+        """
+        New composer snapshot with only the participants whose folder was added,
+        removed or changed since self.signature reloaded, None when a full rebuild
+        is preferable (too many tombstoned rows or a failed reload).
+        """
+        engine = self.engine
+        try:
+            for name in self.signature:
+                if name not in signature:
+                    print(f"Unloading participant index {name}")
+                    engine = engine.remove_participant(self.source / name)
+                elif signature[name] != self.signature[name]:
+                    print(f"Reloading participant index {name}")
+                    engine = engine.replace_participant(self.source / name)
+            for name in signature:
+                if name not in self.signature:
+                    print(f"Loading participant index {name}")
+                    engine = engine.add_participant(self.source / name)
+        except Exception as e:
+            print(f"Hot reload failed ({e}), rebuilding query engine..")
+            return None
+        if engine.n_tombstoned > engine.live_rows():
+            # most rows are dead, compact with a full rebuild
+            return None
+        return engine
+
+    def sync_source(self):
+        # rate limited, called with self._lock held
+        if self.sync is None:
+            return
+        now = time.monotonic()
+        if self.last_sync is not None and now - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = now
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"Index sync failed: {type(e).__name__}: {e}")
+
+    def get(self):
+        # sync, signature and reload under one lock : a get() arriving mid sync waits
+        # for it instead of reading a folder whose files are being replaced
+        with self._lock:
+            self.sync_source()
+            signature = index_signature(self.source, self.use_content_hash)
+            if self.engine is None or signature != self.signature:
+                engine = None
+                if self.engine is not None and self.hot_reload:
+                    engine = self.reload_changed(signature)
+                if engine is None:
+                    print("Index change detected, building query engine..")
+                    engine = load_query_engine(self.source,
+                                               embed_model=self.embed_model,
+                                               llm=self.llm,
+                                               context=self.context,
+                                               ann_backend=self.ann_backend,
+                                               encrypted_mode=self.encrypted_mode,
+                                               memory_map=self.memory_map)
+                # swap the reference, callers holding the old engine are unaffected
+                self.engine = engine
+                self.signature = signature
+                self.engine.index_version = self.version
+                self.engine.response_cache = self.response_cache
+                if self.response_cache is not None:
+                    self.response_cache.invalidate(self.version)
+            return self.engine
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Cache of generated answers looked up by cosine similarity of the query embedding.
+    An entry only matches when it was made against the same index version (the set
+    and content of loaded participant indexes) and the same scope (llm + top_k),
+    entries of any other index version are dropped as soon as the version changes.
+    Only invalidate() moves the version, lookups / stores made against another one
+    (a query still running on the previous snapshot) miss / are dropped.
+    Eviction is LRU (max_entries) plus a ttl in seconds, entries persist to a json
+    file at most every save_interval seconds (and at exit).
+    """
+
+    def __init__(self, persist_path=None, threshold=0.95, max_entries=256,
+                 ttl=24 * 3600, save_interval=30.0):
+        self.persist_path = persist_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.save_interval = save_interval
+        self.last_save = 0.0
+        self.dirty = False
+        if persist_path is not None:
+            self.load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def _set_version(self, index_version):
+        # a new index version invalidates every answer made against older indexes
+        if index_version != self.index_version:
+            self.index_version = index_version
+            for key in [key for key, entry in self.entries.items()
+                        if entry["index_version"] != index_version]:
+                del self.entries[key]
+
+    def _is_current(self, index_version):
+        # first version seen after a restart is adopted, see WarmQueryEngine.get
+        if self.index_version is None:
+            self._set_version(index_version)
+        return index_version == self.index_version
+
+    def _expire(self):
+        now = time.time()
+        for key in [key for key, entry in self.entries.items()
+                    if now - entry["created"] > self.ttl]:
+            del self.entries[key]
+
+    def invalidate(self, index_version=None):
+        with self._lock:
+            self._set_version(index_version)
+            if index_version is None:
+                self.entries.clear()
+        self.save()
+
+    def lookup(self, query_embedding, index_version, scope):
+        with self._lock:
+            if not self._is_current(index_version):
+                self.misses += 1
+                return None
+            self._expire()
+            candidates = [key for key, entry in self.entries.items()
+                          if entry["scope"] == scope]
+            if not candidates:
+                self.misses += 1
+                return None
+            matrix = np.stack([self.entries[key]["embedding"] for key in candidates])
+            similarities = matrix @ self._normalize(query_embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(candidates[best])
+            return self.entries[candidates[best]]["response"]
+
+    def store(self, query, query_embedding, response, index_version, scope):
+        with self._lock:
+            if not self._is_current(index_version):
+                # answer made against a replaced snapshot
+                return
+            self.entries[uuid.uuid4().hex] = {
+                "query": query,
+                "embedding": self._normalize(query_embedding),
+                "response": response,
+                "index_version": index_version,
+                "scope": scope,
+                "created": time.time()
+            }
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            due = time.time() - self.last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def flush(self):
+        if self.dirty:
+            self.save()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.entries)}
+
+    def load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r") as f:
+                for key, entry in json.load(f).items():
+                    entry["embedding"] = np.asarray(entry["embedding"], dtype=np.float32)
+                    self.entries[key] = entry
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"Ignoring unreadable response cache {self.persist_path}: {e}")
+
+    def save(self):
+        if self.persist_path is None:
+            return
+        with self._lock:
+            data = {key: dict(entry, embedding=entry["embedding"].tolist())
+                    for key, entry in self.entries.items()}
+            self.dirty = False
+            self.last_save = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+        with self._save_lock:
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.persist_path)